@@ -0,0 +1,291 @@
+#!/usr/bin/env python
+"""
+Load test of the full media flow against the tests app.
+
+    python benchmarks/loadtest.py                          # 8 clients, 200 files each
+    python benchmarks/loadtest.py --concurrency 32 --token-max-age 1
+
+A stand-in front server wraps the Django WSGI application and serves
+X-Accel-Redirect responses from the internal media root like nginx.
+Each client fetches media URLs and follows the
+media -> web -> media redirect chain, reusing signed URLs until
+their token expires. Reports requests per second, p50/p99 latency
+per file and redirects per file.
+"""
+import argparse
+import mimetypes
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from urllib.parse import urlsplit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MEDIA_ROOT = os.path.join(ROOT, "tests")
+
+sys.path.insert(0, ROOT)
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "tests.settings")
+
+from django.conf import settings  # noqa: E402
+
+# Threads need to share one database, which in-memory SQLite can't do
+DATABASE = tempfile.NamedTemporaryFile(suffix=".sqlite3", delete=False).name
+settings.DATABASES["default"]["NAME"] = DATABASE
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.contrib.auth import get_user_model  # noqa: E402
+from django.core.management import call_command  # noqa: E402
+from django.core.wsgi import get_wsgi_application  # noqa: E402
+from django.db import connections  # noqa: E402
+from django.test import Client  # noqa: E402
+
+from tests.models import Attachment  # noqa: E402
+from tests.views import CustomCrossDomainMediaAuth  # noqa: E402
+
+ACCEL_HEADERS = ("x-accel-redirect", "x-accel-expires", "x-accel-buffering",
+                 "x-accel-limit-rate")
+
+
+class FrontServer:
+    """
+    WSGI middleware that acts like nginx in front of Django:
+    internal redirects are served from internal_root and the
+    internal location can't be requested directly
+    """
+
+    def __init__(self, app, internal_prefix, internal_root):
+        self.app = app
+        self.internal_prefix = internal_prefix.rstrip("/") + "/"
+        self.internal_root = internal_root
+
+    def __call__(self, environ, start_response):
+        if environ["PATH_INFO"].startswith(self.internal_prefix):
+            return self.not_found(start_response)
+        captured = {}
+
+        def capture(status, headers, exc_info=None):
+            captured["status"] = status
+            captured["headers"] = headers
+            return lambda data: None
+
+        body = self.app(environ, capture)
+        headers = captured["headers"]
+        location = dict((k.lower(), v) for k, v in headers).get("x-accel-redirect")
+        if location is None:
+            start_response(captured["status"], headers)
+            return body
+        if hasattr(body, "close"):
+            body.close()
+        return self.serve_internal(location, headers, start_response)
+
+    def serve_internal(self, location, headers, start_response):
+        if not location.startswith(self.internal_prefix):
+            return self.not_found(start_response)
+        relative = os.path.normpath(location[len(self.internal_prefix):])
+        path = os.path.join(self.internal_root, relative)
+        if relative.startswith("..") or not os.path.isfile(path):
+            return self.not_found(start_response)
+        with open(path, "rb") as f:
+            content = f.read()
+        content_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        headers = [
+            (k, v) for k, v in headers
+            if k.lower() not in ACCEL_HEADERS + ("content-type", "content-length")
+        ]
+        headers += [
+            ("Content-Type", content_type),
+            ("Content-Length", str(len(content))),
+        ]
+        start_response("200 OK", headers)
+        return [content]
+
+    def not_found(self, start_response):
+        start_response("404 Not Found", [("Content-Type", "text/plain")])
+        return [b"Not Found"]
+
+
+def request(app, url, cookies):
+    """
+    Send a GET request for an absolute URL to the WSGI app
+    and return status code, headers and body
+    """
+    parts = urlsplit(url)
+    cookie = cookies.get(parts.netloc)
+    environ = {
+        "REQUEST_METHOD": "GET",
+        "PATH_INFO": parts.path,
+        "QUERY_STRING": parts.query,
+        "SERVER_NAME": parts.hostname,
+        "SERVER_PORT": "443" if parts.scheme == "https" else "80",
+        "SERVER_PROTOCOL": "HTTP/1.1",
+        "HTTP_HOST": parts.netloc,
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": parts.scheme,
+        "wsgi.input": BytesIO(),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+    if cookie:
+        environ["HTTP_COOKIE"] = cookie
+    captured = {}
+
+    def start_response(status, headers, exc_info=None):
+        captured["status"] = int(status.split(" ", 1)[0])
+        captured["headers"] = dict((k.lower(), v) for k, v in headers)
+        return lambda data: None
+
+    body = app(environ, start_response)
+    try:
+        content = b"".join(body)
+    finally:
+        if hasattr(body, "close"):
+            body.close()
+    return captured["status"], captured["headers"], content
+
+
+class LoadClient:
+    """
+    Browser stand-in that keeps a session on the web domain
+    and the last signed URL for every file
+    """
+
+    max_redirects = 5
+
+    def __init__(self, app, session_cookie):
+        self.app = app
+        self.cookies = {settings.SITE_DOMAIN: session_cookie}
+        self.signed_urls = {}
+        self.requests = 0
+
+    def fetch(self, media_url):
+        """
+        Fetch a file and return the number of redirects followed
+        """
+        url = self.signed_urls.get(media_url, media_url)
+        for redirects in range(self.max_redirects + 1):
+            status, headers, content = request(self.app, url, self.cookies)
+            self.requests += 1
+            if status in (301, 302):
+                url = headers["location"]
+                continue
+            if status != 200:
+                raise RuntimeError("{} for {}".format(status, url))
+            self.signed_urls[media_url] = url
+            return redirects
+        raise RuntimeError("Too many redirects for {}".format(media_url))
+
+
+def setup_data(files):
+    call_command("migrate", verbosity=0)
+    user = get_user_model().objects.create(
+        username="superuser", is_active=True, is_staff=True, is_superuser=True
+    )
+    attachments = Attachment.objects.bulk_create(
+        Attachment(
+            name="private-{}.txt".format(i),
+            public=False,
+            file="test_files/test-private.txt",
+        )
+        for i in range(files)
+    )
+    media_urls = [
+        CustomCrossDomainMediaAuth({"object": attachment}).get_full_media_url()
+        for attachment in attachments
+    ]
+    client = Client()
+    client.force_login(user)
+    session_cookie = "{}={}".format(
+        settings.SESSION_COOKIE_NAME,
+        client.cookies[settings.SESSION_COOKIE_NAME].value,
+    )
+    return media_urls, session_cookie
+
+
+def run_client(app, session_cookie, media_urls, fetches, seed):
+    client = LoadClient(app, session_cookie)
+    rng = random.Random(seed)
+    latencies = []
+    redirects = 0
+    try:
+        for _ in range(fetches):
+            media_url = rng.choice(media_urls)
+            start = time.perf_counter()
+            redirects += client.fetch(media_url)
+            latencies.append(time.perf_counter() - start)
+    finally:
+        connections.close_all()
+    return latencies, redirects, client.requests
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument(
+        "--fetches", type=int, default=200, help="files fetched per client"
+    )
+    parser.add_argument("--files", type=int, default=50)
+    parser.add_argument(
+        "--token-max-age",
+        type=int,
+        default=CustomCrossDomainMediaAuth.TOKEN_MAX_AGE_SECONDS,
+        help="TOKEN_MAX_AGE_SECONDS, low values force redirects",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    if args.token_max_age < 1:
+        # Tokens would expire before they come back to the media host
+        parser.error("--token-max-age must be at least 1")
+
+    CustomCrossDomainMediaAuth.TOKEN_MAX_AGE_SECONDS = args.token_max_age
+    media_urls, session_cookie = setup_data(args.files)
+    app = FrontServer(
+        get_wsgi_application(), settings.INTERNAL_MEDIA_PREFIX, MEDIA_ROOT
+    )
+    # One warm up fetch outside of the measurement
+    LoadClient(app, session_cookie).fetch(media_urls[0])
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        futures = [
+            executor.submit(
+                run_client, app, session_cookie, media_urls, args.fetches,
+                args.seed + i,
+            )
+            for i in range(args.concurrency)
+        ]
+        results = [future.result() for future in futures]
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(lat for result in results for lat in result[0])
+    redirects = sum(result[1] for result in results)
+    requests = sum(result[2] for result in results)
+    print("clients            {:>10}".format(args.concurrency))
+    print("files fetched      {:>10}".format(len(latencies)))
+    print("requests           {:>10}".format(requests))
+    print("requests/sec       {:>10,.0f}".format(requests / elapsed))
+    print("files/sec          {:>10,.0f}".format(len(latencies) / elapsed))
+    print("p50 latency (ms)   {:>10.2f}".format(percentile(latencies, 0.5) * 1000))
+    print("p99 latency (ms)   {:>10.2f}".format(percentile(latencies, 0.99) * 1000))
+    print("mean latency (ms)  {:>10.2f}".format(statistics.mean(latencies) * 1000))
+    print("redirects per file {:>10.2f}".format(redirects / len(latencies)))
+    return 0
+
+
+if __name__ == "__main__":
+    try:
+        sys.exit(main())
+    finally:
+        os.unlink(DATABASE)
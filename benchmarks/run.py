@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+"""
+Benchmarks for the signing, verification and redirect hot paths.
+
+    python benchmarks/run.py                   # run and compare to baseline
+    python benchmarks/run.py --save-baseline   # store results as new baseline
+    python benchmarks/run.py --filter sign     # only run matching benchmarks
+
+Reports operations per second and the peak memory growth per operation.
+Speed is compared to the local baseline relative to a fixed reference
+workload measured right after each benchmark, which evens out changes
+in machine load.
+Exits with status 1 if a benchmark is slower than the baseline
+by more than the given threshold.
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+sys.path.insert(0, ROOT)
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "tests.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.conf import settings  # noqa: E402
+from django.contrib.auth import get_user_model  # noqa: E402
+from django.core.management import call_command  # noqa: E402
+from django.test import Client, override_settings  # noqa: E402
+from django.test.utils import setup_test_environment  # noqa: E402
+from django.urls import reverse  # noqa: E402
+
+from crossdomainmedia.utils import add_token, strip_path  # noqa: E402
+from tests.models import Attachment  # noqa: E402
+from tests.views import CustomCrossDomainMediaAuth  # noqa: E402
+
+
+class CompactCrossDomainMediaAuth(CustomCrossDomainMediaAuth):
+    COMPACT_TOKENS = True
+
+
+BATCH_SIZE = 100
+
+
+def setup_data():
+    call_command("migrate", verbosity=0)
+    user = get_user_model().objects.create(
+        username="superuser", is_active=True, is_staff=True, is_superuser=True
+    )
+    public = Attachment.objects.create(
+        name="public.txt", public=True, file="test_files/test-public.txt"
+    )
+    private = Attachment.objects.create(
+        name="private.txt", public=False, file="test_files/test-private.txt"
+    )
+    Attachment.objects.bulk_create(
+        Attachment(name="batch-{}.txt".format(i), file="test_files/test-private.txt")
+        for i in range(BATCH_SIZE)
+    )
+    return user, public, private
+
+
+def get_benchmarks():
+    user, public, private = setup_data()
+    mauth = CustomCrossDomainMediaAuth({"object": private})
+    path = mauth.get_media_url_path()
+    media_url = mauth.get_full_media_url()
+    token = mauth.sign_path(path)
+    compact_mauth = CompactCrossDomainMediaAuth({"object": private})
+    compact_token = compact_mauth.sign_path(path)
+    signed_url = mauth.get_full_media_url(authorized=True)
+    private_url = reverse("attachment_file", kwargs={"name": private.name})
+    public_url = reverse("attachment_file", kwargs={"name": public.name})
+
+    batch = list(Attachment.objects.filter(name__startswith="batch-"))
+
+    def sign_loop():
+        for obj in batch:
+            CustomCrossDomainMediaAuth({"object": obj}).get_full_media_url(
+                authorized=True
+            )
+
+    client = Client()
+    client.force_login(user)
+
+    def respond_web():
+        response = client.get(private_url, HTTP_HOST=settings.SITE_DOMAIN)
+        assert response.status_code == 302
+
+    def respond_media():
+        response = client.get(signed_url, HTTP_HOST=settings.MEDIA_DOMAIN)
+        assert response.status_code == 200
+
+    debug_settings = override_settings(
+        DEBUG=True,
+        MEDIA_URL="/media/",
+        MEDIA_ROOT=os.path.join(ROOT, "tests"),
+    )
+
+    def respond_debug():
+        with debug_settings:
+            response = client.get(public_url, HTTP_HOST="localhost")
+            assert response.status_code == 200
+            b"".join(response.streaming_content)
+
+    return {
+        "sign_path": lambda: mauth.sign_path(path),
+        "add_token": lambda: add_token(
+            media_url, mauth.sign_path, mauth.TOKEN_NAME
+        ),
+        "check_token": lambda: mauth.check_token(token),
+        "compact_sign": lambda: compact_mauth.sign_path(path),
+        "compact_check": lambda: compact_mauth.check_token(compact_token),
+        # BATCH_SIZE objects per operation
+        "sign_loop": sign_loop,
+        "sign_batch": lambda: CustomCrossDomainMediaAuth.get_full_media_urls(
+            batch, authorized=True
+        ),
+        "strip_path": lambda: strip_path(settings.MEDIA_URL),
+        "respond_web": respond_web,
+        "respond_media": respond_media,
+        "respond_debug": respond_debug,
+    }
+
+
+def reference():
+    """
+    Fixed workload independent of this package that other
+    benchmarks are compared with
+    """
+    data = json.dumps({str(i): i for i in range(50)}).encode()
+    hashlib.sha256(data).hexdigest()
+    sorted(data)
+
+
+def measure(func, min_time, rounds=5):
+    # Warm up and calibrate number of iterations
+    func()
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        number *= 2
+    # Best of several rounds is least disturbed by other processes
+    for _ in range(rounds - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = min(elapsed, time.perf_counter() - start)
+    ops = number / elapsed
+
+    samples = min(number, 100)
+    tracemalloc.start()
+    peak = 0
+    for _ in range(samples):
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        func()
+        peak += tracemalloc.get_traced_memory()[1] - before
+    tracemalloc.stop()
+    return {"ops_per_sec": ops, "peak_bytes_per_op": peak / samples}
+
+
+def load_baseline():
+    if not os.path.exists(BASELINE):
+        return {}
+    with open(BASELINE) as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--filter", default="", help="run matching benchmarks")
+    parser.add_argument("--min-time", type=float, default=0.5)
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.25,
+        help="allowed slowdown against baseline as fraction",
+    )
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    setup_test_environment()
+    baseline = load_baseline()
+    results = {}
+    regressions = []
+    print(
+        "{:<16} {:>14} {:>10} {:>14} {:>10}".format(
+            "benchmark", "ops/sec", "relative", "peak B/op", "baseline"
+        )
+    )
+    for name, func in get_benchmarks().items():
+        if args.filter not in name:
+            continue
+        result = measure(func, args.min_time)
+        # Speed in multiples of the reference workload, measured
+        # right next to it to share the load of the machine
+        reference_ops = measure(reference, args.min_time)["ops_per_sec"]
+        result["relative"] = result["ops_per_sec"] / reference_ops
+        results[name] = result
+        change = ""
+        if "relative" in baseline.get(name, {}):
+            ratio = result["relative"] / baseline[name]["relative"]
+            change = "{:+.0%}".format(ratio - 1)
+            if ratio < 1 - args.threshold:
+                regressions.append(name)
+        print(
+            "{:<16} {:>14,.0f} {:>10.4f} {:>14,.0f} {:>10}".format(
+                name, result["ops_per_sec"], result["relative"],
+                result["peak_bytes_per_op"], change
+            )
+        )
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.save_baseline:
+        # Absolute speed only holds on the machine that measured it
+        baseline.update(
+            (name, {"relative": result["relative"]})
+            for name, result in results.items()
+        )
+        with open(BASELINE, "w") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+            f.write("\n")
+    if regressions:
+        print("Slower than baseline: {}".format(", ".join(regressions)))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
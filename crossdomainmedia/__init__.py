@@ -1,5 +1,9 @@
 __version__ = "0.0.4"
 
-from .views import CrossDomainMediaAuth, CrossDomainMediaMixin  # noqa
+from .views import (  # noqa
+    AsyncCrossDomainMediaMixin, CrossDomainMediaAuth, CrossDomainMediaMixin
+)
 
-__all__ = [CrossDomainMediaMixin, CrossDomainMediaAuth]
+__all__ = [
+    CrossDomainMediaMixin, AsyncCrossDomainMediaMixin, CrossDomainMediaAuth
+]
@@ -1,13 +1,28 @@
+import hmac
 import os
-from django.conf import settings
+import struct
+import time
+from urllib.parse import quote_plus, unquote
+
+from asgiref.sync import sync_to_async
 from django.core.signing import (
-    TimestampSigner, SignatureExpired, BadSignature
+    SignatureExpired, BadSignature,
+    b62_decode, b62_encode, b64_decode, b64_encode
 )
-from django.core.exceptions import PermissionDenied
+from django.core.exceptions import ImproperlyConfigured, PermissionDenied
 from django.contrib.auth import get_permission_codename
+from django.utils.encoding import escape_uri_path
 
+from .backends import get_internal_redirect_backend
+from .cache import (
+    aget_cached_signed_url, get_cached_signed_url, get_verified_token_cache
+)
+from .conf import get_config
+from .instrumentation import get_observer
+from .permcache import get_cached_decision
+from .signing import get_compact_macs, get_key_fingerprint, get_signer
 from .utils import (
-    add_token, strip_path, send_internal_file
+    add_token, send_internal_file
 )
 
 
@@ -29,11 +44,44 @@ class BadToken(CrossDomainMediaAuthException):
 
 class CrossDomainMediaAuth:
     SIGNING_SEPARATOR = ':'
+    SIGNING_SALT = None
     TOKEN_NAME = 'token'
     TOKEN_MAX_AGE_SECONDS = 2 * 60
+    # Align token timestamps to buckets of this many seconds
+    # so URLs stay identical (and cacheable) within a bucket
+    TOKEN_BUCKET_SECONDS = None
+    # Include the media file path in the token so the media host
+    # can serve the file without looking up the object
+    BIND_FILE_PATH = False
+    # Sign a path prefix instead of a single path, so one token
+    # authorizes every file below it (requires get_token_prefix)
+    PREFIX_SCOPED_TOKENS = False
+    # Replace timestamp and signature with one base64 part holding
+    # a packed timestamp and a MAC truncated to COMPACT_MAC_LENGTH bytes
+    COMPACT_TOKENS = False
+    COMPACT_DIGEST = 'blake2b'
+    COMPACT_MAC_LENGTH = 12
+    # Remember this many verified tokens in process until they expire,
+    # optionally shared through the given Django cache alias
+    VERIFIED_TOKEN_CACHE_SIZE = 0
+    VERIFIED_TOKEN_CACHE_ALIAS = None
+    # Cache has_perm decisions per user, object and permission
+    # for this many seconds in the given Django cache
+    PERMISSION_CACHE_TIMEOUT = None
+    PERMISSION_CACHE_ALIAS = 'default'
+    # Share authorized media URLs through this Django cache alias
+    # until their token bucket ends, without buckets for this
+    # fraction of the token lifetime
+    SIGNED_URL_CACHE_ALIAS = None
+    SIGNED_URL_CACHE_FRACTION = 0.25
+    # Passed on to the front server with internal redirects,
+    # e.g. as X-Accel-Buffering and X-Accel-Limit-Rate for nginx
+    INTERNAL_BUFFERING = None
+    INTERNAL_LIMIT_RATE = None
     PERMISSION = 'view'
     SITE_URL = None
-    DEBUG = settings.DEBUG
+    # None follows settings.DEBUG
+    DEBUG = None
 
     def __init__(self, context):
         self.context = context
@@ -59,30 +107,45 @@ class CrossDomainMediaAuth:
         raise NotImplementedError  # pragma: no cover
 
     def get_site_url(self):
-        return self.SITE_URL or settings.SITE_URL
+        return self.SITE_URL or get_config().site_url
 
     def get_media_url_path(self):
         return self.get_auth_url()
 
-    def get_media_url(self):
+    def get_media_origin(self):
         '''
         Only use domain part of MEDIA_URL if it exists
         '''
-        return strip_path(settings.MEDIA_URL) + self.get_media_url_path()
+        return get_config().media_origin
+
+    def get_media_url(self):
+        return self.get_media_origin() + self.get_media_url_path()
 
     def get_internal_media_prefix(self):
-        return getattr(settings, 'INTERNAL_MEDIA_PREFIX', '/protected')
+        return get_config().internal_prefix
 
     def is_debug(self):
-        return settings.DEBUG
+        if self.DEBUG is not None:
+            return self.DEBUG
+        return get_config().debug
 
-    def get_media_internal_url_path(self):
+    def get_media_internal_url_path(self, file_path=None):
         '''
         Return the internal URL path for nginx to the actual media file
         '''
+        if file_path is None:
+            file_path = self.get_media_file_path()
         return os.path.join(
             self.get_internal_media_prefix(),
-            self.get_media_file_path()
+            file_path
+        )
+
+    def get_permission_name(self, obj):
+        opts = obj.__class__._meta
+        codename = get_permission_codename(self.PERMISSION, opts)
+        return '{app_label}.{codename}'.format(
+            app_label=opts.app_label,
+            codename=codename
         )
 
     def has_perm(self, request):
@@ -93,12 +156,50 @@ class CrossDomainMediaAuth:
 
         user = request.user
         obj = self.context['object']
-        opts = obj.__class__._meta
-        codename = get_permission_codename(self.PERMISSION, opts)
-        return user.has_perm('{app_label}.{codename}'.format(
-            app_label=opts.app_label,
-            codename=codename
-        ), obj=obj)
+        return user.has_perm(self.get_permission_name(obj), obj=obj)
+
+    async def ahas_perm(self, request):
+        '''
+        Async version of has_perm, stays on the event loop
+        where the user and Django allow it
+        '''
+        if (type(self).has_perm is not CrossDomainMediaAuth.has_perm or
+                not hasattr(request, 'auser')):
+            return await sync_to_async(self.has_perm)(request)
+        user = await request.auser()
+        obj = self.context['object']
+        perm = self.get_permission_name(obj)
+        if hasattr(user, 'ahas_perm'):
+            return await user.ahas_perm(perm, obj=obj)
+        # Same shortcut as PermissionsMixin.has_perm
+        if user.is_active and getattr(user, 'is_superuser', False):
+            return True
+        return await sync_to_async(user.has_perm)(perm, obj=obj)
+
+    def cached_has_perm(self, request):
+        '''
+        has_perm with decisions cached for PERMISSION_CACHE_TIMEOUT,
+        invalidated when the object, the user or permissions change
+        '''
+        if self.PERMISSION_CACHE_TIMEOUT is None:
+            return self.has_perm(request)
+        obj = self.context['object']
+        return get_cached_decision(
+            request.user, obj, self.get_permission_name(obj),
+            lambda: self.has_perm(request),
+            self.PERMISSION_CACHE_TIMEOUT,
+            cache_alias=self.PERMISSION_CACHE_ALIAS
+        )
+
+    def timed_has_perm(self, request):
+        with get_observer().timer('has_perm'):
+            return self.cached_has_perm(request)
+
+    async def atimed_has_perm(self, request):
+        with get_observer().timer('has_perm'):
+            if self.PERMISSION_CACHE_TIMEOUT is None:
+                return await self.ahas_perm(request)
+            return await sync_to_async(self.cached_has_perm)(request)
 
     def get_full_auth_url(self):
         '''
@@ -118,7 +219,7 @@ class CrossDomainMediaAuth:
         '''
         In DEBUG mode check permission or token
         '''
-        if self.is_media_public() or self.has_perm(request):
+        if self.is_media_public() or self.timed_has_perm(request):
             return self.get_media_file_path()
         try:
             self.check_token_request(request)
@@ -126,36 +227,328 @@ class CrossDomainMediaAuth:
         except Exception:
             raise PermissionDenied
 
+    async def aget_file_path(self, request):
+        if self.is_media_public() or await self.atimed_has_perm(request):
+            return self.get_media_file_path()
+        try:
+            await self.acheck_token_request(request)
+            return self.get_media_file_path()
+        except Exception:
+            raise PermissionDenied
+
     def get_full_media_url(self, authorized=False):
         url = self.get_media_url()
         if authorized:
-            url = self.add_token(url)
+            if self.SIGNED_URL_CACHE_ALIAS is not None:
+                return get_cached_signed_url(
+                    self.SIGNED_URL_CACHE_ALIAS,
+                    self.get_signed_url_cache_key(url),
+                    self.get_signed_url_cache_timeout(),
+                    lambda: self.sign_media_url(url)
+                )
+            url = self.sign_media_url(url)
         return url
 
+    async def aget_full_media_url(self, authorized=False):
+        '''
+        Async version of get_full_media_url,
+        the signed URL cache is queried without blocking
+        '''
+        if not authorized or self.SIGNED_URL_CACHE_ALIAS is None:
+            return self.get_full_media_url(authorized=authorized)
+        url = self.get_media_url()
+        return await aget_cached_signed_url(
+            self.SIGNED_URL_CACHE_ALIAS,
+            self.get_signed_url_cache_key(url),
+            self.get_signed_url_cache_timeout(),
+            lambda: self.sign_media_url(url)
+        )
+
+    def sign_media_url(self, url):
+        with get_observer().timer('sign'):
+            return self.add_token(url)
+
+    def get_signed_url_cache_key(self, url):
+        '''
+        Signed URLs depend on the auth class, the signing key
+        and the media URL, and on the file path if it is bound
+        '''
+        cls = self.__class__
+        signer = self.get_signer()
+        parts = [
+            '{}.{}'.format(cls.__module__, cls.__qualname__),
+            getattr(signer, 'key_id', None) or '',
+            get_key_fingerprint(signer), url
+        ]
+        if self.BIND_FILE_PATH:
+            parts.append(self.get_media_file_path())
+        return parts
+
+    def get_signed_url_cache_timeout(self):
+        '''
+        Bucketed tokens are the same until the bucket ends,
+        others lose lifetime while they are cached
+        '''
+        bucket = self.get_token_bucket_seconds()
+        if bucket:
+            return int(bucket - time.time() % bucket)
+        return int(self.get_token_max_age() * self.SIGNED_URL_CACHE_FRACTION)
+
+    @classmethod
+    def make_context(cls, context):
+        if not isinstance(context, dict):
+            context = {'object': context}
+        return context
+
+    @classmethod
+    def get_full_media_urls(cls, contexts, authorized=False):
+        '''
+        Return media URLs for many contexts (or plain objects) at once.
+        The whole batch shares one media origin, one signer
+        and one token timestamp.
+        '''
+        return cls.build_media_urls(
+            (cls(cls.make_context(context)), authorized)
+            for context in contexts
+        )
+
+    @classmethod
+    def get_authorized_media_urls(cls, request, contexts):
+        '''
+        Like get_authorized_media_url for many contexts (or plain objects)
+        with a single filter_permitted call. Denied media give None.
+        '''
+        mauths = [cls(cls.make_context(context)) for context in contexts]
+        public = {id(mauth) for mauth in mauths if mauth.is_media_public()}
+        with get_observer().timer('has_perm'):
+            permitted = {id(mauth) for mauth in cls.filter_permitted(
+                request, [mauth for mauth in mauths if id(mauth) not in public]
+            )}
+        allowed = [
+            (mauth, id(mauth) in permitted) for mauth in mauths
+            if id(mauth) in public or id(mauth) in permitted
+        ]
+        urls = {
+            id(mauth): url for (mauth, _), url in
+            zip(allowed, cls.build_media_urls(allowed))
+        }
+        return [urls.get(id(mauth)) for mauth in mauths]
+
+    @classmethod
+    def build_media_urls(cls, pairs):
+        '''
+        Return media URLs for (mauth, authorized) pairs
+        sharing media origin, signer and timestamp
+        '''
+        urls = []
+        observer = get_observer()
+        media_origin = signer = timestamp = None
+        for mauth, authorized in pairs:
+            auth_class = type(mauth)
+            if auth_class.get_media_url is CrossDomainMediaAuth.get_media_url:
+                if media_origin is None:
+                    media_origin = mauth.get_media_origin()
+                path = mauth.get_media_url_path()
+                url = media_origin + path
+            else:
+                path = None
+                url = mauth.get_media_url()
+            if authorized:
+                if signer is None:
+                    signer = mauth.get_signer()
+                    timestamp = mauth.get_token_timestamp(signer)
+                with observer.timer('sign'):
+                    # Plain paths are signed without parsing the URL
+                    if (auth_class.add_token is CrossDomainMediaAuth.add_token and
+                            path is not None and
+                            '?' not in path and '#' not in path):
+                        token = mauth.sign_path(
+                            path, signer=signer, timestamp=timestamp
+                        )
+                        url = '{}?{}={}'.format(
+                            url, quote_plus(mauth.TOKEN_NAME), quote_plus(token)
+                        )
+                    else:
+                        url = mauth.add_token(
+                            url, signer=signer, timestamp=timestamp
+                        )
+            urls.append(url)
+        return urls
+
+    @classmethod
+    def filter_permitted(cls, request, mauths):
+        '''
+        Return the auth instances whose media the user may access.
+        Defaults to has_perm for each one, override to check all
+        objects with a constant number of queries.
+        '''
+        return [mauth for mauth in mauths if mauth.has_perm(request)]
+
     def get_authorized_media_url(self, request):
         if self.is_media_public():
             return self.get_full_media_url(authorized=False)
-        if self.has_perm(request):
+        if self.timed_has_perm(request):
             return self.get_full_media_url(authorized=True)
         raise PermissionDenied
 
+    async def aget_authorized_media_url(self, request):
+        if self.is_media_public():
+            return self.get_full_media_url(authorized=False)
+        if await self.atimed_has_perm(request):
+            return await self.aget_full_media_url(authorized=True)
+        raise PermissionDenied
+
+    def get_default_signer(self):
+        '''
+        Signers are shared and keep their derived HMAC key,
+        they are dropped when SECRET_KEY changes
+        '''
+        return get_signer(sep=self.SIGNING_SEPARATOR, salt=self.SIGNING_SALT)
+
     def get_signer(self):
-        return TimestampSigner(sep=self.SIGNING_SEPARATOR)
+        '''
+        Uses CROSSDOMAINMEDIA_SIGNING_KEY_ID if configured
+        '''
+        key_id = get_config().signing_key_id
+        if key_id is None:
+            return self.get_default_signer()
+        return self.get_verifying_signer(key_id)
+
+    def get_verifying_signer(self, key_id):
+        '''
+        Return the signer for a key id from CROSSDOMAINMEDIA_SIGNING_KEYS
+        or the signer of tokens without key id if key_id is None
+        '''
+        if key_id is None:
+            # Tokens are verified with the signer they were signed with,
+            # which may come from an overridden get_signer
+            signer = self.get_signer()
+            if getattr(signer, 'key_id', None) is not None:
+                signer = self.get_default_signer()
+            return signer
+        return get_signer(
+            sep=self.SIGNING_SEPARATOR, salt=self.SIGNING_SALT,
+            key=get_config().signing_keys[key_id], key_id=key_id
+        )
+
+    def get_token_timestamp(self, signer):
+        bucket = self.get_token_bucket_seconds()
+        if not bucket:
+            return signer.timestamp()
+        now = int(time.time())
+        return b62_encode(now - now % bucket)
 
-    def sign_path(self, path):
+    def sign_path(self, path, signer=None, timestamp=None):
+        '''
+        Return token for path, signer and timestamp
+        can be passed in to share them across many paths
+        '''
         path = self.get_path_to_sign(path)
+        if self.PREFIX_SCOPED_TOKENS:
+            path = self.get_token_prefix(path)
         SEP = self.SIGNING_SEPARATOR
-        signer = self.get_signer()
-        return SEP.join(signer.sign(path).rsplit(SEP, 2)[-2:])
+        if signer is None:
+            signer = self.get_signer()
+        if timestamp is None:
+            timestamp = self.get_token_timestamp(signer)
+        if self.COMPACT_TOKENS:
+            parts = self.get_token_payload(path)
+            parts.append(self.get_compact_part(
+                signer, path, SEP.join(parts), b62_decode(timestamp)
+            ))
+        else:
+            parts = self.get_token_payload(path) + [timestamp]
+            signature = signer.signature(SEP.join([path] + parts))
+            parts.append(signature)
+        key_id = getattr(signer, 'key_id', None)
+        if key_id is not None:
+            parts.insert(0, key_id)
+        return SEP.join(parts)
+
+    def get_compact_macs(self, signer):
+        return get_compact_macs(
+            signer, digest=self.COMPACT_DIGEST, length=self.COMPACT_MAC_LENGTH
+        )
+
+    def get_compact_mac(self, compact_mac, path, payload, packed_timestamp):
+        return compact_mac.digest(
+            path.encode('utf-8'), b'\0', payload.encode('utf-8'), b'\0',
+            packed_timestamp
+        )
 
-    def add_token(self, url):
+    def get_compact_part(self, signer, path, payload, timestamp):
+        '''
+        Return packed timestamp and truncated MAC over path,
+        signed payload and timestamp as base64
+        '''
+        packed_timestamp = struct.pack('>I', timestamp)
+        compact_mac = self.get_compact_macs(signer)[0]
+        mac = self.get_compact_mac(compact_mac, path, payload, packed_timestamp)
+        return b64_encode(packed_timestamp + mac).decode('ascii')
+
+    def unpack_compact_part(self, part):
+        try:
+            raw = b64_decode(part.encode('ascii'))
+        except ValueError:
+            raise BadToken()
+        if len(raw) != 4 + self.COMPACT_MAC_LENGTH:
+            raise BadToken()
+        return raw[:4], raw[4:]
+
+    def check_compact_token(self, signer, path, token, max_age):
+        '''
+        Verify a compact token against path directly
+        and return the same value as unsign would
+        '''
+        payload, _, part = token.rpartition(self.SIGNING_SEPARATOR)
+        packed_timestamp, mac = self.unpack_compact_part(part)
+        for compact_mac in self.get_compact_macs(signer):
+            expected = self.get_compact_mac(
+                compact_mac, path, payload, packed_timestamp
+            )
+            if hmac.compare_digest(expected, mac):
+                break
+        else:
+            raise BadToken()
+        timestamp = struct.unpack('>I', packed_timestamp)[0]
+        if time.time() - timestamp > max_age:
+            raise ExpiredToken()
+        if payload:
+            return path + self.SIGNING_SEPARATOR + payload
+        return path
+
+    def get_token_payload(self, path):
+        '''
+        Return extra signed token parts that come before the timestamp
+        '''
+        if self.PREFIX_SCOPED_TOKENS:
+            if self.BIND_FILE_PATH:
+                raise ImproperlyConfigured(
+                    'Prefix scoped tokens cannot be bound to a file'
+                )
+            return [b64_encode(path.encode('utf-8')).decode('ascii')]
+        if self.BIND_FILE_PATH:
+            file_path = self.get_media_file_path()
+            return [b64_encode(file_path.encode('utf-8')).decode('ascii')]
+        return []
+
+    def add_token(self, url, signer=None, timestamp=None):
         return add_token(
             url,
-            self.sign_path,
+            lambda path: self.sign_path(
+                path, signer=signer, timestamp=timestamp
+            ),
             self.TOKEN_NAME
         )
 
     def get_path_to_sign(self, path):
+        '''
+        File bound tokens are also checked against the request path,
+        which is quoted differently than reverse() output, so they
+        sign the unquoted path
+        '''
+        if self.BIND_FILE_PATH:
+            return unquote(path)
         return path
 
     def get_token(self, request):
@@ -164,29 +557,161 @@ class CrossDomainMediaAuth:
     def get_token_max_age(self):
         return self.TOKEN_MAX_AGE_SECONDS
 
+    def get_token_bucket_seconds(self):
+        return self.TOKEN_BUCKET_SECONDS
+
+    def get_token_grace_max_age(self):
+        '''
+        Bucketed tokens may carry a timestamp up to one bucket
+        older than the moment they were handed out
+        '''
+        return self.get_token_max_age() + (self.get_token_bucket_seconds() or 0)
+
     def check_token_request(self, request):
         token = self.get_token(request)
-        return self.check_token(token)
+        with get_observer().timer('check_token'):
+            return self.check_token(token)
+
+    async def acheck_token_request(self, request):
+        '''
+        Async version of check_token_request, a shared verified
+        token cache is queried in a thread
+        '''
+        if self.VERIFIED_TOKEN_CACHE_ALIAS is not None:
+            return await sync_to_async(self.check_token_request)(request)
+        return self.check_token_request(request)
 
-    def check_token(self, token):
+    def check_token(self, token, path=None):
         if token is None:
             raise MissingToken()
 
-        path = self.get_path_to_sign(
-            self.get_media_url_path()
+        if path is None:
+            path = self.get_media_url_path()
+        path = self.get_path_to_sign(path)
+        key_id, signed_token = self.split_key_id(token)
+        if self.PREFIX_SCOPED_TOKENS:
+            path = self.get_token_scope(path, signed_token)
+        signer = self.get_verifying_signer(key_id)
+        token_cache = self.get_verified_token_cache()
+        if token_cache is not None:
+            fingerprint = get_key_fingerprint(signer)
+            value = token_cache.get(path, token, fingerprint)
+            if value is not None:
+                return value
+
+        max_age = self.get_token_grace_max_age()
+        if self.COMPACT_TOKENS:
+            value = self.check_compact_token(
+                signer, path, signed_token, max_age
+            )
+        else:
+            # Reconstruct original signature
+            original = '{}{}{}'.format(
+                path, self.SIGNING_SEPARATOR, signed_token
+            )
+            try:
+                value = signer.unsign(original, max_age=max_age)
+            except SignatureExpired:
+                raise ExpiredToken()
+            except BadSignature:
+                raise BadToken()
+
+        if token_cache is not None:
+            token_cache.set(
+                path, token, value, self.get_token_expiry(token), fingerprint
+            )
+        return value
+
+    def split_key_id(self, token):
+        '''
+        Split a leading key id from CROSSDOMAINMEDIA_SIGNING_KEYS off token.
+        Tokens without a known key id are checked against SECRET_KEY.
+        '''
+        signing_keys = get_config().signing_keys
+        if signing_keys:
+            key_id, sep, rest = token.partition(self.SIGNING_SEPARATOR)
+            if sep and key_id in signing_keys:
+                return key_id, rest
+        return None, token
+
+    def get_token_prefix(self, path):
+        '''
+        Return the prefix a token for path authorizes. Every file
+        below it is opened by the token, so there is no default.
+        '''
+        raise NotImplementedError(
+            'PREFIX_SCOPED_TOKENS needs get_token_prefix to choose the '
+            'prefix a token authorizes'
         )
-        # Reconstruct original signature
-        original = '{}:{}'.format(path, token)
-        signer = self.get_signer()
-        max_age = self.get_token_max_age()
+
+    def get_token_scope(self, path, token):
+        '''
+        Return the prefix of a prefix scoped token
+        if it covers path
+        '''
+        encoded_prefix = token.split(self.SIGNING_SEPARATOR, 1)[0]
         try:
-            return signer.unsign(original, max_age=max_age)
-        except SignatureExpired:
-            raise ExpiredToken()
-        except BadSignature:
+            prefix = b64_decode(encoded_prefix.encode('ascii')).decode('utf-8')
+        except ValueError:
             raise BadToken()
+        if not prefix or not path.startswith(prefix):
+            raise BadToken()
+        return prefix
+
+    def get_token_expiry(self, token):
+        '''
+        Return the unix time at which a valid token expires
+        '''
+        if self.COMPACT_TOKENS:
+            part = token.rsplit(self.SIGNING_SEPARATOR, 1)[-1]
+            packed_timestamp, _ = self.unpack_compact_part(part)
+            timestamp = struct.unpack('>I', packed_timestamp)[0]
+        else:
+            timestamp = b62_decode(token.rsplit(self.SIGNING_SEPARATOR, 2)[-2])
+        return timestamp + self.get_token_grace_max_age()
+
+    def get_verified_token_cache(self):
+        return get_verified_token_cache(self.__class__)
+
+    def get_stateless_file_path(self, request):
+        '''
+        Verify a file bound token against the request path alone
+        and return the path of the file it grants access to.
+        Returns None when the token is missing or not file bound.
+        '''
+        return self.check_file_token(
+            escape_uri_path(request.path), self.get_token(request)
+        )
 
-    def send_internal_file(self):
+    def check_file_token(self, path, token):
+        if token is None:
+            return None
+        with get_observer().timer('check_token'):
+            value = self.check_token(token, path=path)
+        prefix = self.get_path_to_sign(path) + self.SIGNING_SEPARATOR
+        if not value.startswith(prefix):
+            return None
+        try:
+            file_path = b64_decode(value[len(prefix):].encode('ascii'))
+            return file_path.decode('utf-8')
+        except ValueError:
+            raise BadToken()
+
+    def send_internal_file(self, file_path=None):
+        if file_path is None:
+            file_path = self.get_media_file_path()
         return send_internal_file(
-            self.get_media_internal_url_path()
+            self.get_media_internal_url_path(file_path), file_path
+        )
+
+    def set_cache_headers(self, response, token):
+        '''
+        Set caching headers that last as long as the verified token
+        '''
+        max_age = max(0, int(self.get_token_expiry(token) - time.time()))
+        get_internal_redirect_backend().set_cache_headers(
+            response, max_age,
+            buffering=self.INTERNAL_BUFFERING,
+            limit_rate=self.INTERNAL_LIMIT_RATE
         )
+        return response
@@ -0,0 +1,109 @@
+import mimetypes
+import os
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.http import HttpResponse
+from django.utils.cache import patch_cache_control
+from django.utils.module_loading import import_string
+
+_backend = None
+
+
+class InternalRedirectBackend:
+    '''
+    Hands the file transfer over to the front server
+    with an internal redirect header
+    '''
+    header = None
+
+    def get_header_value(self, url, file_path):
+        return url
+
+    def get_content_type(self, url, file_path):
+        # Content-Type is filled in by the front server
+        return ''
+
+    def send_file(self, url, file_path=None):
+        response = HttpResponse()
+        response['Content-Type'] = self.get_content_type(url, file_path)
+        response[self.header] = self.get_header_value(url, file_path)
+        return response
+
+    def set_cache_headers(self, response, max_age, buffering=None,
+                          limit_rate=None):
+        '''
+        Let browsers keep the response for as long as the token is valid
+        '''
+        patch_cache_control(response, private=True, max_age=max_age)
+
+
+class NginxBackend(InternalRedirectBackend):
+    header = 'X-Accel-Redirect'
+
+    def set_cache_headers(self, response, max_age, buffering=None,
+                          limit_rate=None):
+        super().set_cache_headers(response, max_age)
+        response['X-Accel-Expires'] = str(max_age)
+        if buffering is not None:
+            response['X-Accel-Buffering'] = 'yes' if buffering else 'no'
+        if limit_rate is not None:
+            response['X-Accel-Limit-Rate'] = str(limit_rate)
+
+
+class LiteSpeedBackend(InternalRedirectBackend):
+    header = 'X-LiteSpeed-Location'
+
+
+class SendfileBackend(InternalRedirectBackend):
+    '''
+    X-Sendfile as used by Apache mod_xsendfile and lighttpd
+    expects the absolute file system path
+    '''
+    header = 'X-Sendfile'
+
+    def get_header_value(self, url, file_path):
+        if file_path is None:
+            raise ImproperlyConfigured(
+                '{} needs the file path relative to MEDIA_ROOT'.format(
+                    self.__class__.__name__
+                )
+            )
+        return os.path.join(settings.MEDIA_ROOT, file_path)
+
+    def get_content_type(self, url, file_path):
+        content_type, encoding = mimetypes.guess_type(file_path or url)
+        return content_type or 'application/octet-stream'
+
+
+BACKENDS = {
+    'nginx': NginxBackend,
+    'apache': SendfileBackend,
+    'lighttpd': SendfileBackend,
+    'litespeed': LiteSpeedBackend,
+}
+
+
+def get_internal_redirect_backend():
+    '''
+    Return the backend named in CROSSDOMAINMEDIA_INTERNAL_REDIRECT,
+    either one of BACKENDS or a dotted path to a backend class
+    '''
+    global _backend
+    if _backend is None:
+        name = getattr(settings, 'CROSSDOMAINMEDIA_INTERNAL_REDIRECT', 'nginx')
+        if name in BACKENDS:
+            backend_class = BACKENDS[name]
+        else:
+            backend_class = import_string(name)
+        _backend = backend_class()
+    return _backend
+
+
+@receiver(setting_changed)
+def reset_backend(*, setting, **kwargs):
+    global _backend
+    if setting == 'CROSSDOMAINMEDIA_INTERNAL_REDIRECT':
+        _backend = None
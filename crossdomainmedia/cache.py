@@ -0,0 +1,160 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+SIGNED_URL_KEY_PREFIX = 'crossdomainmedia:url:'
+
+_token_caches = {}
+_token_caches_lock = threading.Lock()
+
+
+class VerifiedTokenCache:
+    '''
+    Bounded LRU of verified (path, token) pairs that expire together
+    with their token, optionally backed by a shared Django cache.
+    Entries are scoped by namespace (the auth class) and by the
+    fingerprint of the key that verified them.
+    '''
+    KEY_PREFIX = 'crossdomainmedia:token:'
+
+    def __init__(self, maxsize, cache_alias=None, namespace=''):
+        self.maxsize = maxsize
+        self.cache_alias = cache_alias
+        self.namespace = namespace
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_shared_cache(self):
+        if self.cache_alias is None:
+            return None
+        return caches[self.cache_alias]
+
+    def make_shared_key(self, key):
+        parts = (self.namespace,) + key
+        digest = hashlib.sha256('\n'.join(parts).encode('utf-8')).hexdigest()
+        return self.KEY_PREFIX + digest
+
+    def get(self, path, token, fingerprint=''):
+        key = (fingerprint, path, token)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires = entry
+                if expires > now:
+                    self._entries.move_to_end(key)
+                    return value
+                del self._entries[key]
+
+        shared_cache = self.get_shared_cache()
+        if shared_cache is None:
+            return None
+        entry = shared_cache.get(self.make_shared_key(key))
+        if entry is None:
+            return None
+        value, expires = entry
+        if expires <= now:
+            return None
+        self._store(key, value, expires)
+        return value
+
+    def set(self, path, token, value, expires, fingerprint=''):
+        key = (fingerprint, path, token)
+        timeout = expires - time.time()
+        if timeout <= 0:
+            return
+        self._store(key, value, expires)
+        shared_cache = self.get_shared_cache()
+        if shared_cache is not None:
+            shared_cache.set(
+                self.make_shared_key(key), (value, expires),
+                timeout=int(timeout) + 1
+            )
+
+    def _store(self, key, value, expires):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (value, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def get_verified_token_cache(auth_class):
+    '''
+    Return the verified token cache of the given auth class
+    or None if it is not enabled
+    '''
+    cache = _token_caches.get(auth_class)
+    if cache is not None:
+        return cache
+    maxsize = auth_class.VERIFIED_TOKEN_CACHE_SIZE
+    cache_alias = auth_class.VERIFIED_TOKEN_CACHE_ALIAS
+    if not maxsize and cache_alias is None:
+        return None
+    with _token_caches_lock:
+        cache = _token_caches.get(auth_class)
+        if cache is None:
+            cache = VerifiedTokenCache(
+                maxsize, cache_alias=cache_alias,
+                namespace='{}.{}'.format(
+                    auth_class.__module__, auth_class.__qualname__
+                )
+            )
+            _token_caches[auth_class] = cache
+    return cache
+
+
+def get_signed_url_key(key_parts):
+    digest = hashlib.sha256('\n'.join(key_parts).encode('utf-8')).hexdigest()
+    return SIGNED_URL_KEY_PREFIX + digest
+
+
+def get_cached_signed_url(cache_alias, key_parts, timeout, sign):
+    '''
+    Return the signed URL cached under key_parts or call sign()
+    and cache its result for timeout seconds
+    '''
+    if timeout <= 0:
+        return sign()
+    cache = caches[cache_alias]
+    key = get_signed_url_key(key_parts)
+    url = cache.get(key)
+    if url is None:
+        url = sign()
+        cache.set(key, url, timeout)
+    return url
+
+
+async def aget_cached_signed_url(cache_alias, key_parts, timeout, sign):
+    '''
+    Async version of get_cached_signed_url
+    '''
+    if timeout <= 0:
+        return sign()
+    cache = caches[cache_alias]
+    key = get_signed_url_key(key_parts)
+    url = await cache.aget(key)
+    if url is None:
+        url = sign()
+        await cache.aset(key, url, timeout)
+    return url
+
+
+@receiver(setting_changed)
+def reset_token_caches(*, setting, **kwargs):
+    if setting in ('SECRET_KEY', 'SECRET_KEY_FALLBACKS',
+                   'CROSSDOMAINMEDIA_SIGNING_KEYS'):
+        with _token_caches_lock:
+            for cache in _token_caches.values():
+                cache.clear()
@@ -0,0 +1,60 @@
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from .utils import strip_path
+
+SETTINGS = (
+    'MEDIA_URL', 'INTERNAL_MEDIA_PREFIX', 'SITE_URL', 'DEBUG',
+    'CROSSDOMAINMEDIA_SIGNING_KEYS', 'CROSSDOMAINMEDIA_SIGNING_KEY_ID',
+)
+
+_config = None
+
+
+class MediaConfig:
+    '''
+    Settings parsed once and shared until one of them changes
+    '''
+    def __init__(self):
+        media_url = settings.MEDIA_URL
+        parsed = urlsplit(media_url)
+        self.media_host = parsed.netloc
+        self.media_path = parsed.path
+        self.media_origin = strip_path(media_url)
+        self.internal_prefix = getattr(
+            settings, 'INTERNAL_MEDIA_PREFIX', '/protected'
+        )
+        self.site_url = getattr(settings, 'SITE_URL', None)
+        self.debug = settings.DEBUG
+        # Key id -> key of active and retired token signing keys
+        self.signing_keys = dict(
+            getattr(settings, 'CROSSDOMAINMEDIA_SIGNING_KEYS', None) or {}
+        )
+        self.signing_key_id = getattr(
+            settings, 'CROSSDOMAINMEDIA_SIGNING_KEY_ID', None
+        )
+        if (self.signing_key_id is not None and
+                self.signing_key_id not in self.signing_keys):
+            raise ImproperlyConfigured(
+                'CROSSDOMAINMEDIA_SIGNING_KEY_ID must be a key of '
+                'CROSSDOMAINMEDIA_SIGNING_KEYS'
+            )
+
+
+def get_config():
+    global _config
+    config = _config
+    if config is None:
+        config = _config = MediaConfig()
+    return config
+
+
+@receiver(setting_changed)
+def reset_config(*, setting, **kwargs):
+    global _config
+    if setting in SETTINGS:
+        _config = None
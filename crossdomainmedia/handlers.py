@@ -0,0 +1,104 @@
+'''
+WSGI and ASGI middleware for the media host that answer requests
+with valid file bound tokens before they reach Django.
+
+    application = MediaHostWSGIMiddleware(
+        get_wsgi_application(), CustomCrossDomainMediaAuth
+    )
+
+The auth class needs BIND_FILE_PATH = True. Requests without token,
+with expired tokens or for other hosts and paths are passed on to
+the wrapped application, which redirects back to the web domain.
+'''
+from urllib.parse import parse_qsl
+
+from django.http import HttpResponse
+from django.utils.encoding import escape_uri_path
+
+from .auth import BadToken, ExpiredToken
+from .conf import get_config
+from .instrumentation import get_observer
+
+
+class MediaHostMiddlewareBase:
+    def __init__(self, app, media_auth_class, prefix=None):
+        self.app = app
+        self.media_auth_class = media_auth_class
+        self.prefix = prefix
+
+    def get_response(self, host, path, query_string):
+        '''
+        Return response for a verified request
+        or None to pass it on to the wrapped application
+        '''
+        config = get_config()
+        prefix = config.media_path if self.prefix is None else self.prefix
+        if host != config.media_host or not path.startswith(prefix):
+            return None
+        mauth = self.media_auth_class({})
+        if mauth.is_debug():
+            return None
+        token = None
+        for key, value in parse_qsl(query_string):
+            if key == mauth.TOKEN_NAME:
+                token = value
+                break
+        try:
+            file_path = mauth.check_file_token(escape_uri_path(path), token)
+        except ExpiredToken:
+            return None
+        except BadToken:
+            get_observer().count('stateless', 'bad')
+            return HttpResponse(status=403)
+        if file_path is None:
+            return None
+        get_observer().count('stateless', 'served')
+        response = mauth.send_internal_file(file_path)
+        return mauth.set_cache_headers(response, token)
+
+    def get_response_headers(self, response):
+        return list(response.items())
+
+
+class MediaHostWSGIMiddleware(MediaHostMiddlewareBase):
+    def __call__(self, environ, start_response):
+        path = environ.get('SCRIPT_NAME', '') + environ.get('PATH_INFO', '')
+        path = path.encode('iso-8859-1').decode('utf-8', 'replace')
+        host = environ.get('HTTP_HOST') or environ.get('SERVER_NAME', '')
+        response = self.get_response(
+            host, path, environ.get('QUERY_STRING', '')
+        )
+        if response is None:
+            return self.app(environ, start_response)
+        status = '{} {}'.format(response.status_code, response.reason_phrase)
+        start_response(status, self.get_response_headers(response))
+        return [response.content]
+
+
+class MediaHostASGIMiddleware(MediaHostMiddlewareBase):
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        host = ''
+        for key, value in scope.get('headers', ()):
+            if key == b'host':
+                host = value.decode('latin1')
+                break
+        path = scope['path']
+        response = self.get_response(
+            host, path, scope.get('query_string', b'').decode('latin1')
+        )
+        if response is None:
+            return await self.app(scope, receive, send)
+        await send({
+            'type': 'http.response.start',
+            'status': response.status_code,
+            'headers': [
+                (key.encode('latin1'), value.encode('latin1'))
+                for key, value in self.get_response_headers(response)
+            ],
+        })
+        await send({
+            'type': 'http.response.body',
+            'body': response.content,
+        })
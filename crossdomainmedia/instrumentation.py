@@ -0,0 +1,147 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+_observer = None
+_null_timer = nullcontext()
+
+
+class Observer:
+    '''
+    Receives outcome counts and operation timings.
+    Subclass and point CROSSDOMAINMEDIA_OBSERVER to it.
+
+    Flows and their outcomes:
+      - media: served, expired, missing, bad
+      - stateless: served, bad
+      - web: redirect, denied
+      - debug: served, denied
+
+    Timed operations: object_lookup, has_perm, sign, check_token
+    '''
+    def count(self, flow, outcome):
+        pass
+
+    def observe(self, operation, seconds):
+        pass
+
+    @contextmanager
+    def timer(self, operation):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(operation, time.perf_counter() - start)
+
+
+class NullObserver(Observer):
+    def timer(self, operation):
+        return _null_timer
+
+
+class MetricsCollector(Observer):
+    '''
+    Keeps per-outcome counters and latency histograms in process
+    and renders them in Prometheus text format
+    '''
+    BUCKETS = (
+        0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+        0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+    )
+    PREFIX = 'crossdomainmedia'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    def count(self, flow, outcome):
+        key = (flow, outcome)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + 1
+
+    def observe(self, operation, seconds):
+        index = bisect.bisect_left(self.BUCKETS, seconds)
+        with self._lock:
+            histogram = self.histograms.get(operation)
+            if histogram is None:
+                histogram = {
+                    'buckets': [0] * (len(self.BUCKETS) + 1),
+                    'sum': 0.0, 'count': 0
+                }
+                self.histograms[operation] = histogram
+            histogram['buckets'][index] += 1
+            histogram['sum'] += seconds
+            histogram['count'] += 1
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+    def render(self):
+        lines = [
+            '# TYPE {}_responses_total counter'.format(self.PREFIX)
+        ]
+        with self._lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(
+                (operation, dict(histogram, buckets=list(histogram['buckets'])))
+                for operation, histogram in self.histograms.items()
+            )
+        for (flow, outcome), value in counters:
+            lines.append(
+                '{}_responses_total{{flow="{}",outcome="{}"}} {}'.format(
+                    self.PREFIX, flow, outcome, value
+                )
+            )
+        lines.append('# TYPE {}_duration_seconds histogram'.format(self.PREFIX))
+        for operation, histogram in histograms:
+            cumulative = 0
+            bounds = [repr(b) for b in self.BUCKETS] + ['+Inf']
+            for bound, value in zip(bounds, histogram['buckets']):
+                cumulative += value
+                lines.append(
+                    '{}_duration_seconds_bucket{{operation="{}",le="{}"}} {}'.format(
+                        self.PREFIX, operation, bound, cumulative
+                    )
+                )
+            lines.append('{}_duration_seconds_sum{{operation="{}"}} {}'.format(
+                self.PREFIX, operation, histogram['sum']
+            ))
+            lines.append('{}_duration_seconds_count{{operation="{}"}} {}'.format(
+                self.PREFIX, operation, histogram['count']
+            ))
+        return '\n'.join(lines) + '\n'
+
+
+def get_observer():
+    '''
+    Return the observer configured in CROSSDOMAINMEDIA_OBSERVER
+    as dotted path to a class or instance
+    '''
+    global _observer
+    if _observer is None:
+        observer = getattr(settings, 'CROSSDOMAINMEDIA_OBSERVER', None)
+        if observer is None:
+            observer = NullObserver()
+        else:
+            if isinstance(observer, str):
+                observer = import_string(observer)
+            if isinstance(observer, type):
+                observer = observer()
+        _observer = observer
+    return _observer
+
+
+@receiver(setting_changed)
+def reset_observer(*, setting, **kwargs):
+    global _observer
+    if setting == 'CROSSDOMAINMEDIA_OBSERVER':
+        _observer = None
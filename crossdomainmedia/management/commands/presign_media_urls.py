@@ -0,0 +1,59 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.module_loading import import_string
+
+from crossdomainmedia.presign import FORMATS, write_signed_urls
+
+
+class Command(BaseCommand):
+    help = 'Write signed media URLs for all objects of a model as JSONL or CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument('model', help='app_label.ModelName')
+        parser.add_argument(
+            'auth_class', help='dotted path to a CrossDomainMediaAuth subclass'
+        )
+        parser.add_argument(
+            '--filter', action='append', default=[], metavar='FIELD=VALUE',
+            help='only include matching objects, may be repeated'
+        )
+        parser.add_argument('--output', help='file to write, default stdout')
+        parser.add_argument('--format', choices=FORMATS)
+        parser.add_argument('--chunk-size', type=int, default=2000)
+        parser.add_argument(
+            '--workers', type=int, default=None,
+            help='signing processes, default one per CPU, 0 signs in process'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            model = apps.get_model(options['model'])
+            import_string(options['auth_class'])
+        except (LookupError, ValueError, ImportError) as e:
+            raise CommandError(e)
+        filters = {}
+        for item in options['filter']:
+            key, sep, value = item.partition('=')
+            if not sep:
+                raise CommandError('Filters need to be FIELD=VALUE')
+            filters[key] = value
+        queryset = model._default_manager.filter(**filters).order_by('pk')
+
+        output_path = options['output']
+        format = options['format']
+        if format is None:
+            format = 'csv' if output_path and output_path.endswith('.csv') else 'jsonl'
+        kwargs = dict(
+            format=format, chunk_size=options['chunk_size'],
+            workers=options['workers']
+        )
+        if output_path:
+            with open(output_path, 'w', newline='') as output:
+                count = write_signed_urls(
+                    options['auth_class'], queryset, output, **kwargs
+                )
+        else:
+            count = write_signed_urls(
+                options['auth_class'], queryset, self.stdout, **kwargs
+            )
+        self.stderr.write('Signed {} media URLs'.format(count))
@@ -0,0 +1,140 @@
+import re
+
+from asgiref.sync import sync_to_async
+from django.http import FileResponse
+
+from .conf import get_config
+from .refresh import refresh_media_urls
+
+MEMO_ATTRIBUTE = '_crossdomainmedia_signed_urls'
+# URL-safe ASCII without quotes and parentheses that end URLs in HTML and CSS
+URL_CHARS = rb"[A-Za-z0-9\-._~:/?#\[\]@!$&*+,;=%]*"
+
+
+class SignMediaURLsMiddleware:
+    '''
+    Finds media URLs without query string in HTML and JSON responses
+    and replaces them with authorized media URLs. Streaming responses
+    are rewritten chunk by chunk. Place it below compressing middleware
+    like GZipMiddleware in MIDDLEWARE.
+    '''
+    content_types = ('text/html', 'application/json')
+    # Longest incomplete URL kept back between streamed chunks
+    max_carry = 4096
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if self.should_rewrite(request, response):
+            self.rewrite_response(request, response)
+        return response
+
+    def should_rewrite(self, request, response):
+        '''
+        Only rewrite pages of the web host, never served files
+        '''
+        if response.status_code != 200 or response.has_header('Content-Encoding'):
+            return False
+        if isinstance(response, FileResponse):
+            return False
+        media_host = get_config().media_host
+        if not media_host or request.get_host() == media_host:
+            return False
+        content_type = response.get('Content-Type', '').split(';')[0]
+        return content_type in self.content_types
+
+    def rewrite_response(self, request, response):
+        origin = get_config().media_origin.encode('ascii')
+        # The path has to follow the origin, so longer host names
+        # that start with it are not matched
+        pattern = re.compile(re.escape(origin) + b'/' + URL_CHARS)
+        if not response.streaming:
+            response.content = self.rewrite(request, pattern, response.content)
+            if response.has_header('Content-Length'):
+                response['Content-Length'] = str(len(response.content))
+            return
+        if response.has_header('Content-Length'):
+            del response['Content-Length']
+        if response.is_async:
+            response.streaming_content = self.arewrite_stream(
+                request, pattern, origin, response.streaming_content
+            )
+        else:
+            response.streaming_content = self.rewrite_stream(
+                request, pattern, origin, response.streaming_content
+            )
+
+    def rewrite(self, request, pattern, content):
+        urls = [
+            url.decode('ascii') for url in pattern.findall(content)
+            if b'?' not in url and b'#' not in url
+        ]
+        if not urls:
+            return content
+        memo = getattr(request, MEMO_ATTRIBUTE, None)
+        if memo is None:
+            memo = {}
+            setattr(request, MEMO_ATTRIBUTE, memo)
+        missing = [url for url in set(urls) if url not in memo]
+        if missing:
+            memo.update(refresh_media_urls(request, missing))
+
+        def replace(match):
+            url = match.group(0)
+            signed_url = memo.get(url.decode('ascii'))
+            if signed_url is None:
+                return url
+            return signed_url.encode('ascii')
+
+        return pattern.sub(replace, content)
+
+    def split_carry(self, pattern, origin, buffer):
+        '''
+        Return the position from which buffer may end
+        in an incomplete media URL
+        '''
+        start = buffer.rfind(origin)
+        if start != -1:
+            match = pattern.match(buffer, start)
+            # Without a match the origin may still be completed by /
+            end = match.end() if match else start + len(origin)
+            if end == len(buffer) and len(buffer) - start <= self.max_carry:
+                return start
+        for length in range(min(len(origin) - 1, len(buffer)), 0, -1):
+            if buffer.endswith(origin[:length]):
+                return len(buffer) - length
+        return len(buffer)
+
+    def rewrite_chunk(self, request, pattern, origin, carry, chunk):
+        buffer = carry + bytes(chunk)
+        cut = self.split_carry(pattern, origin, buffer)
+        return self.rewrite(request, pattern, buffer[:cut]), buffer[cut:]
+
+    def rewrite_stream(self, request, pattern, origin, chunks):
+        carry = b''
+        for chunk in chunks:
+            content, carry = self.rewrite_chunk(
+                request, pattern, origin, carry, chunk
+            )
+            if content:
+                yield content
+        if carry:
+            yield self.rewrite(request, pattern, carry)
+
+    async def arewrite_stream(self, request, pattern, origin, chunks):
+        '''
+        Async version of rewrite_stream, permission checks
+        may hit the database and run in a thread
+        '''
+        carry = b''
+        rewrite_chunk = sync_to_async(self.rewrite_chunk)
+        async for chunk in chunks:
+            content, carry = await rewrite_chunk(
+                request, pattern, origin, carry, chunk
+            )
+            if content:
+                yield content
+        if carry:
+            yield await sync_to_async(self.rewrite)(request, pattern, carry)
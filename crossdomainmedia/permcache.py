@@ -0,0 +1,155 @@
+import hashlib
+import uuid
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+KEY_PREFIX = 'crossdomainmedia:perm:'
+GLOBAL_VERSION_KEY = KEY_PREFIX + 'version'
+
+_registry = None
+
+
+def get_registry():
+    '''
+    Return {model label: cache aliases} from
+    CROSSDOMAINMEDIA_PERMISSION_CACHES, e.g.
+    {'default': ['documents.Document']}. Read from settings in every
+    process, so saves anywhere invalidate cached decisions.
+    '''
+    global _registry
+    registry = _registry
+    if registry is None:
+        registry = {}
+        configured = getattr(settings, 'CROSSDOMAINMEDIA_PERMISSION_CACHES', {})
+        for cache_alias, labels in configured.items():
+            for label in labels:
+                registry.setdefault(label.lower(), set()).add(cache_alias)
+        _registry = registry
+    return registry
+
+
+def get_cache_aliases():
+    return set().union(*get_registry().values())
+
+
+def check_registered(model, cache_alias):
+    label = model._meta.concrete_model._meta.label_lower
+    if cache_alias not in get_registry().get(label, ()):
+        raise ImproperlyConfigured(
+            'Add {} to CROSSDOMAINMEDIA_PERMISSION_CACHES[{!r}] to cache '
+            'permission decisions about it'.format(label, cache_alias)
+        )
+
+
+def get_object_version_key(obj):
+    return '{}obj:{}:{}'.format(
+        KEY_PREFIX, obj._meta.concrete_model._meta.label_lower, obj.pk
+    )
+
+
+def get_user_version_key(user_pk):
+    return '{}user:{}'.format(KEY_PREFIX, user_pk)
+
+
+def get_versions(cache, keys):
+    '''
+    Return the current version for each key, creating missing ones
+    '''
+    versions = cache.get_many(keys)
+    missing = [key for key in keys if key not in versions]
+    if missing:
+        for key in missing:
+            cache.add(key, uuid.uuid4().hex, None)
+        versions.update(cache.get_many(missing))
+    return [versions.get(key, '') for key in keys]
+
+
+def bump_version(key, aliases=None):
+    '''
+    Replace the version under key so decisions stored
+    with the old one are no longer found
+    '''
+    for alias in get_cache_aliases() if aliases is None else aliases:
+        caches[alias].set(key, uuid.uuid4().hex, None)
+
+
+def get_decision_key(cache, user, obj, perm):
+    versions = get_versions(cache, [
+        GLOBAL_VERSION_KEY,
+        get_object_version_key(obj),
+        get_user_version_key(user.pk),
+    ])
+    parts = [
+        str(user.pk), obj._meta.concrete_model._meta.label_lower,
+        str(obj.pk), perm
+    ] + versions
+    digest = hashlib.sha256('\n'.join(parts).encode('utf-8')).hexdigest()
+    return KEY_PREFIX + 'decision:' + digest
+
+
+def get_cached_decision(user, obj, perm, check, timeout, cache_alias='default'):
+    '''
+    Return the cached result of check() for user, obj and perm
+    or call check() and cache its result for timeout seconds.
+    Anonymous users and unsaved objects are not cached.
+    '''
+    if user.pk is None or getattr(obj, 'pk', None) is None:
+        return check()
+    check_registered(type(obj), cache_alias)
+    cache = caches[cache_alias]
+    # Versions are read before checking, so a change during
+    # the check stores the decision under an outdated key
+    key = get_decision_key(cache, user, obj, perm)
+    decision = cache.get(key)
+    if decision is None:
+        decision = bool(check())
+        cache.set(key, decision, timeout)
+    return decision
+
+
+def get_auth_models():
+    from django.contrib.auth.models import Group, Permission
+
+    return get_user_model(), Group, Permission
+
+
+@receiver([post_save, post_delete])
+def invalidate_instance(sender, instance, **kwargs):
+    registry = get_registry()
+    if not registry:
+        return
+    model = sender._meta.concrete_model
+    aliases = registry.get(model._meta.label_lower)
+    if aliases:
+        bump_version(get_object_version_key(instance), aliases)
+    user_model, group_model, permission_model = get_auth_models()
+    if model is user_model._meta.concrete_model:
+        bump_version(get_user_version_key(instance.pk))
+    elif model in (group_model, permission_model):
+        bump_version(GLOBAL_VERSION_KEY)
+
+
+@receiver(m2m_changed)
+def invalidate_permissions(sender, instance, action, reverse, **kwargs):
+    if not get_registry() or not action.startswith('post_'):
+        return
+    user_model, group_model, permission_model = get_auth_models()
+    owner = sender._meta.auto_created
+    if owner is user_model and not reverse:
+        # User permissions or groups of a single user changed
+        bump_version(get_user_version_key(instance.pk))
+    elif owner in (user_model, group_model):
+        bump_version(GLOBAL_VERSION_KEY)
+
+
+@receiver(setting_changed)
+def reset_registry(*, setting, **kwargs):
+    global _registry
+    if setting == 'CROSSDOMAINMEDIA_PERMISSION_CACHES':
+        _registry = None
@@ -0,0 +1,141 @@
+import csv
+import json
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.utils.module_loading import import_string
+
+FORMATS = ('jsonl', 'csv')
+
+
+def init_worker(settings_module):
+    if settings_module:
+        os.environ['DJANGO_SETTINGS_MODULE'] = settings_module
+    django.setup()
+
+
+def sign_chunk(auth_class, objects):
+    '''
+    Return (pk, media URL) pairs for objects, authorized URLs
+    for private media. The chunk shares one signer and timestamp.
+    '''
+    if isinstance(auth_class, str):
+        auth_class = import_string(auth_class)
+    mauths = [auth_class(auth_class.make_context(obj)) for obj in objects]
+    urls = auth_class.build_media_urls(
+        (mauth, not mauth.is_media_public()) for mauth in mauths
+    )
+    return [(obj.pk, url) for obj, url in zip(objects, urls)]
+
+
+def iter_chunks(queryset, chunk_size):
+    chunk = []
+    for obj in queryset.iterator(chunk_size=chunk_size):
+        chunk.append(obj)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def get_auth_class_path(auth_class):
+    '''
+    Return the dotted path worker processes import auth_class from
+    '''
+    if isinstance(auth_class, str):
+        path, auth_class = auth_class, import_string(auth_class)
+    else:
+        path = '{}.{}'.format(auth_class.__module__, auth_class.__qualname__)
+        try:
+            imported = import_string(path)
+        except ImportError:
+            imported = None
+        if imported is not auth_class:
+            raise ValueError(
+                '{} can not be imported from {} by worker processes, define '
+                'it at module level or sign with workers=0'.format(
+                    auth_class.__name__, path
+                )
+            )
+    return path
+
+
+def iter_signed_urls(auth_class, queryset, chunk_size=2000, workers=None):
+    '''
+    Yield (pk, media URL) for every object of queryset in order.
+    auth_class is a CrossDomainMediaAuth subclass or its dotted path.
+    Chunks are signed by a pool of worker processes (default: one per
+    CPU, 0 signs in this process) with a bounded number of chunks in flight.
+    On a single CPU the default signs in this process.
+    '''
+    if workers is None:
+        cpus = os.cpu_count() or 1
+        workers = cpus if cpus > 1 else 0
+    chunks = iter_chunks(queryset, chunk_size)
+    if not workers:
+        return (
+            item for chunk in chunks for item in sign_chunk(auth_class, chunk)
+        )
+    # Fail before the first chunk is read
+    return iter_pool_signed_urls(
+        get_auth_class_path(auth_class), chunks, workers
+    )
+
+
+def iter_pool_signed_urls(auth_class_path, chunks, workers):
+    # Spawned workers share no database connections with this process
+    executor = ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=init_worker,
+        initargs=(os.environ.get('DJANGO_SETTINGS_MODULE'),),
+    )
+    pending = deque()
+    try:
+        for chunk in chunks:
+            pending.append(
+                executor.submit(sign_chunk, auth_class_path, chunk)
+            )
+            if len(pending) >= workers * 2:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown()
+
+
+def write_signed_urls(auth_class, queryset, output, format='jsonl',
+                      chunk_size=2000, workers=None):
+    '''
+    Write pk and media URL of every object in queryset to the
+    text file output as JSON lines or CSV and return the count
+    '''
+    if format not in FORMATS:
+        raise ValueError('Unknown format {}'.format(format))
+    rows = iter_signed_urls(
+        auth_class, queryset, chunk_size=chunk_size, workers=workers
+    )
+    if format == 'csv':
+        writer = csv.writer(output)
+        writer.writerow(['pk', 'url'])
+
+        def write(pk, url):
+            writer.writerow([pk, url])
+    else:
+        def write(pk, url):
+            output.write(json.dumps({'pk': pk, 'url': url}, default=str) + '\n')
+
+    count = 0
+    for pk, url in rows:
+        write(pk, url)
+        count += 1
+        if count % chunk_size == 0:
+            output.flush()
+    output.flush()
+    return count
@@ -0,0 +1,81 @@
+import json
+from urllib.parse import urlsplit
+
+from asgiref.sync import async_to_sync
+from django.http import Http404, HttpResponseBadRequest, JsonResponse
+from django.urls import Resolver404, get_script_prefix, resolve
+from django.views import View
+
+from .views import AsyncCrossDomainMediaMixin, CrossDomainMediaMixin
+
+
+def get_media_auth(request, path):
+    '''
+    Resolve a media URL path to the auth instance of its view
+    or return None if it is not a known media path
+    '''
+    script_prefix = get_script_prefix()
+    if script_prefix != '/' and path.startswith(script_prefix):
+        path = '/' + path[len(script_prefix):]
+    try:
+        match = resolve(path, urlconf=getattr(request, 'urlconf', None))
+    except Resolver404:
+        return None
+    view_class = getattr(match.func, 'view_class', None)
+    if view_class is None or not issubclass(view_class, CrossDomainMediaMixin):
+        return None
+    view = view_class(**match.func.view_initkwargs)
+    view.setup(request, *match.args, **match.kwargs)
+    if issubclass(view_class, AsyncCrossDomainMediaMixin):
+        # Async views may only implement aget_object
+        get_object = async_to_sync(view.aget_object)
+    else:
+        get_object = view.get_object
+    try:
+        view.object = get_object()
+    except Http404:
+        return None
+    context = view.get_context_data(object=view.object)
+    return view.media_auth_class(context)
+
+
+def refresh_media_urls(request, urls):
+    '''
+    Return a dict mapping each given media URL or path to a freshly
+    signed media URL, or None if it is unknown or access is denied.
+    Permissions are checked once per auth class.
+    '''
+    paths = {url: urlsplit(url).path for url in urls}
+    by_class = {}
+    for path in set(paths.values()):
+        mauth = get_media_auth(request, path)
+        if mauth is not None:
+            by_class.setdefault(mauth.__class__, []).append((path, mauth))
+
+    fresh_urls = {}
+    for auth_class, items in by_class.items():
+        signed = auth_class.get_authorized_media_urls(
+            request, [mauth.context for path, mauth in items]
+        )
+        for (path, mauth), url in zip(items, signed):
+            fresh_urls[path] = url
+    return {url: fresh_urls.get(path) for url, path in paths.items()}
+
+
+class MediaRefreshView(View):
+    '''
+    POST a JSON object {"urls": [...]} with media URLs or paths
+    to get {"urls": {url: fresh_url_or_null}} back
+    '''
+    max_urls = 500
+
+    def post(self, request, *args, **kwargs):
+        try:
+            data = json.loads(request.body)
+            urls = data['urls']
+        except (ValueError, TypeError, KeyError):
+            return HttpResponseBadRequest()
+        if (not isinstance(urls, list) or len(urls) > self.max_urls or
+                not all(isinstance(url, str) for url in urls)):
+            return HttpResponseBadRequest()
+        return JsonResponse({'urls': refresh_media_urls(request, urls)})
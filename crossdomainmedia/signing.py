@@ -0,0 +1,134 @@
+import hashlib
+import hmac
+import threading
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.core.signing import TimestampSigner, b64_encode
+from django.dispatch import receiver
+from django.utils.encoding import force_bytes
+
+# Keep the salt of plain TimestampSigner so existing tokens stay valid
+DEFAULT_SALT = 'django.core.signing.TimestampSigner'
+
+_signers = {}
+_compact_macs = {}
+_signers_lock = threading.Lock()
+
+
+class PrecomputedTimestampSigner(TimestampSigner):
+    '''
+    TimestampSigner that derives the HMAC key once
+    and only pays for the final HMAC on every signature
+    '''
+    def __init__(self, *, salt=None, key_id=None, **kwargs):
+        super().__init__(salt=salt or DEFAULT_SALT, **kwargs)
+        # Id of the key, prepended to tokens signed with it
+        self.key_id = key_id
+        self._hmacs = {}
+        for key in [self.key, *self.fallback_keys]:
+            self._hmacs[key] = self._make_hmac(key)
+
+    def _make_hmac(self, key):
+        hasher = getattr(hashlib, self.algorithm)
+        key_salt = force_bytes(self.salt + 'signer')
+        derived_key = hasher(key_salt + force_bytes(key)).digest()
+        return hmac.new(derived_key, digestmod=hasher)
+
+    def signature(self, value, key=None):
+        base = self._hmacs.get(key or self.key)
+        if base is None:
+            return super().signature(value, key=key)
+        mac = base.copy()
+        mac.update(force_bytes(value))
+        return b64_encode(mac.digest()).decode()
+
+
+class CompactMAC:
+    '''
+    Keyed digest truncated to length bytes for compact tokens,
+    BLAKE2 is keyed directly, other hashlib digests through HMAC
+    '''
+    def __init__(self, key, salt, digest='blake2b', length=12):
+        derived_key = hashlib.sha256(
+            force_bytes(salt + 'compact') + force_bytes(key)
+        ).digest()
+        if digest in ('blake2b', 'blake2s'):
+            self._base = getattr(hashlib, digest)(
+                key=derived_key, digest_size=length
+            )
+        else:
+            self._base = hmac.new(derived_key, digestmod=digest)
+        self.length = length
+
+    def digest(self, *parts):
+        mac = self._base.copy()
+        for part in parts:
+            mac.update(part)
+        return mac.digest()[:self.length]
+
+
+def get_compact_macs(signer, digest='blake2b', length=12):
+    '''
+    Return shared compact MACs for the key
+    and fallback keys of signer
+    '''
+    keys = (signer.key, *signer.fallback_keys)
+    cache_key = (keys, signer.salt, digest, length)
+    macs = _compact_macs.get(cache_key)
+    if macs is None:
+        macs = [
+            CompactMAC(key, signer.salt, digest=digest, length=length)
+            for key in keys
+        ]
+        with _signers_lock:
+            _compact_macs[cache_key] = macs
+    return macs
+
+
+def get_key_fingerprint(signer):
+    '''
+    Return a short hash of the key, fallback keys and salt of signer.
+    It changes whenever tokens of signer would verify differently.
+    '''
+    fingerprint = getattr(signer, 'fingerprint', None)
+    if fingerprint is None:
+        keys = [signer.key, *getattr(signer, 'fallback_keys', [])]
+        material = b'\0'.join(force_bytes(part) for part in [signer.salt] + keys)
+        fingerprint = hashlib.sha256(material).hexdigest()[:16]
+        # Shared signers only compute it once
+        signer.fingerprint = fingerprint
+    return fingerprint
+
+
+def get_signer(sep=':', salt=None, key=None, key_id=None):
+    '''
+    Return a shared signer for this key/salt/separator combination.
+    Signers for an explicit key do not try SECRET_KEY_FALLBACKS.
+    '''
+    cache_key = (key or settings.SECRET_KEY, salt, sep, key_id)
+    signer = _signers.get(cache_key)
+    if signer is None:
+        with _signers_lock:
+            signer = _signers.get(cache_key)
+            if signer is None:
+                kwargs = {}
+                if key is not None:
+                    kwargs['fallback_keys'] = []
+                signer = PrecomputedTimestampSigner(
+                    key=key, salt=salt, sep=sep, key_id=key_id, **kwargs
+                )
+                _signers[cache_key] = signer
+    return signer
+
+
+def clear_signers():
+    with _signers_lock:
+        _signers.clear()
+        _compact_macs.clear()
+
+
+@receiver(setting_changed)
+def reset_signers(*, setting, **kwargs):
+    if setting in ('SECRET_KEY', 'SECRET_KEY_FALLBACKS'):
+        clear_signers()
@@ -0,0 +1,140 @@
+import mimetypes
+import os
+import posixpath
+import re
+import stat
+
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotModified
+from django.utils._os import safe_join
+from django.utils.http import http_date, parse_etags, parse_http_date_safe
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class FileRange:
+    '''
+    File-like object that reads only `length` bytes from `start`.
+    It exposes fileno() so sendfile based wsgi.file_wrapper
+    implementations can send the range without copying.
+    '''
+    def __init__(self, file, start, length):
+        self.file = file
+        self.remaining = length
+        file.seek(start)
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return b''
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+def get_etag(statobj):
+    return '"{:x}-{:x}"'.format(statobj.st_mtime_ns, statobj.st_size)
+
+
+def is_not_modified(request, etag, mtime):
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match is not None:
+        etags = parse_etags(if_none_match)
+        return '*' in etags or etag in etags
+    if_modified_since = request.META.get('HTTP_IF_MODIFIED_SINCE')
+    if if_modified_since is not None:
+        since = parse_http_date_safe(if_modified_since)
+        return since is not None and int(mtime) <= since
+    return False
+
+
+def get_range(request, etag, mtime, size):
+    '''
+    Return (start, length) of a single satisfiable byte range,
+    None to send the full file or False if it can't be satisfied
+    '''
+    match = RANGE_RE.match(request.META.get('HTTP_RANGE', '').strip())
+    if match is None:
+        return None
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if if_range is not None and if_range != etag:
+        if parse_http_date_safe(if_range) != int(mtime):
+            return None
+    first, last = match.groups()
+    if not first:
+        if not last:
+            return None
+        # Suffix range with the last n bytes
+        length = min(int(last), size)
+        if length == 0:
+            return False
+        return size - length, length
+    first = int(first)
+    if first >= size:
+        return False
+    last = int(last) if last else size - 1
+    if last < first:
+        return None
+    return first, min(last, size - 1) - first + 1
+
+
+def serve(request, path, document_root):
+    '''
+    Serve a file below document_root with support for
+    conditional requests and single byte ranges.
+    Conditional requests are answered before the file is opened.
+    '''
+    path = posixpath.normpath(path).lstrip('/')
+    try:
+        fullpath = safe_join(document_root, path)
+    except SuspiciousFileOperation:
+        raise Http404('"%s" does not exist' % path)
+    try:
+        statobj = os.stat(fullpath)
+    except OSError:
+        raise Http404('"%s" does not exist' % path)
+    if not stat.S_ISREG(statobj.st_mode):
+        raise Http404('"%s" does not exist' % path)
+
+    etag = get_etag(statobj)
+    mtime = statobj.st_mtime
+    size = statobj.st_size
+    if is_not_modified(request, etag, mtime):
+        response = HttpResponseNotModified()
+        response['ETag'] = etag
+        return response
+
+    content_type, encoding = mimetypes.guess_type(fullpath)
+    content_type = content_type or 'application/octet-stream'
+    byte_range = get_range(request, etag, mtime, size)
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = 'bytes */{}'.format(size)
+        return response
+
+    fileobj = open(fullpath, 'rb')
+    if byte_range is None:
+        response = FileResponse(fileobj, content_type=content_type)
+    else:
+        start, length = byte_range
+        response = FileResponse(
+            FileRange(fileobj, start, length),
+            content_type=content_type, status=206
+        )
+        response['Content-Length'] = str(length)
+        response['Content-Range'] = 'bytes {}-{}/{}'.format(
+            start, start + length - 1, size
+        )
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(mtime)
+    if encoding:
+        response['Content-Encoding'] = encoding
+    return response
@@ -0,0 +1,78 @@
+from django import template
+from django.contrib.auth.models import AnonymousUser
+from django.http import HttpRequest
+
+register = template.Library()
+
+MEMO_ATTRIBUTE = '_crossdomainmedia_urls'
+
+
+def get_memo(request):
+    memo = getattr(request, MEMO_ATTRIBUTE, None)
+    if memo is None:
+        memo = {}
+        setattr(request, MEMO_ATTRIBUTE, memo)
+    return memo
+
+
+def get_auth_context(obj, auth_class=None):
+    '''
+    Return auth class and context for obj, by default from
+    the object's get_crossdomain_auth() method
+    '''
+    if auth_class is not None:
+        return auth_class, auth_class.make_context(obj)
+    mauth = obj.get_crossdomain_auth()
+    return mauth.__class__, mauth.context
+
+
+def get_media_urls(request, objects, auth_class=None):
+    '''
+    Return authorized media URLs for objects, memoized on the request.
+    Objects not seen before are signed in one batch per auth class.
+    '''
+    if request is None:
+        request = HttpRequest()
+        request.user = AnonymousUser()
+    memo = get_memo(request)
+    keys = []
+    missing = {}
+    for obj in objects:
+        mauth_class, context = get_auth_context(obj, auth_class)
+        key = (mauth_class, obj._meta.label, obj.pk)
+        keys.append(key)
+        if key not in memo:
+            missing.setdefault(mauth_class, {})[key] = context
+    for mauth_class, contexts in missing.items():
+        urls = mauth_class.get_authorized_media_urls(
+            request, list(contexts.values())
+        )
+        memo.update(zip(contexts.keys(), urls))
+    return [memo[key] for key in keys]
+
+
+@register.simple_tag(takes_context=True)
+def media_url(context, obj, auth_class=None):
+    '''
+    Render the authorized media URL of obj or an empty string
+    if access is denied.
+
+        {% media_url attachment %}
+    '''
+    url = get_media_urls(context.get('request'), [obj], auth_class)[0]
+    return url or ''
+
+
+@register.simple_tag(takes_context=True)
+def prefetch_media_urls(context, objects, auth_class=None):
+    '''
+    Sign the media URLs of all objects in one batch,
+    use before a loop that renders media_url
+
+        {% prefetch_media_urls attachments %}
+        {% for attachment in attachments %}
+          {% media_url attachment %}
+        {% endfor %}
+    '''
+    get_media_urls(context.get('request'), objects, auth_class)
+    return ''
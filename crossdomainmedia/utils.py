@@ -1,8 +1,9 @@
-from urllib.parse import parse_qs, urlsplit, urlunsplit
+from urllib.parse import parse_qs, quote_plus, urlsplit, urlunsplit
 
-from django.http import HttpResponse
 from django.utils.http import urlencode
 
+from .backends import get_internal_redirect_backend
+
 
 def strip_path(url):
     scheme, netloc, path, query_string, fragment = urlsplit(url)
@@ -16,6 +17,9 @@ def add_token(url, sign_func, token_name):
     """
     scheme, netloc, path, query_string, fragment = urlsplit(url)
     token = sign_func(path)
+    if '?' not in url and '#' not in url:
+        # Fast path for the common case of a plain media URL
+        return '{}?{}={}'.format(url, quote_plus(token_name), quote_plus(token))
     query_params = parse_qs(query_string)
     query_params.update({token_name: token})
     new_query_string = urlencode(query_params, doseq=True)
@@ -23,9 +27,9 @@ def add_token(url, sign_func, token_name):
                        str(new_query_string), str(fragment)))
 
 
-def send_internal_file(url):
-    response = HttpResponse()
-    # Content-Type is filled in by nginx
-    response['Content-Type'] = ""
-    response['X-Accel-Redirect'] = url
-    return response
+def send_internal_file(url, file_path=None):
+    """
+    Let the front server send the file with the internal redirect
+    backend configured in CROSSDOMAINMEDIA_INTERNAL_REDIRECT
+    """
+    return get_internal_redirect_backend().send_file(url, file_path)
@@ -1,21 +1,25 @@
-from urllib.parse import urlparse
-
+from asgiref.sync import sync_to_async
 from django.conf import settings
 from django.core.exceptions import PermissionDenied
-from django.http import HttpResponse
+from django.http import Http404, HttpResponse
 from django.shortcuts import redirect
-from django.views.static import serve
+from django.utils.translation import gettext as _
 
 from .auth import BadToken, CrossDomainMediaAuth, ExpiredToken, MissingToken
+from .conf import get_config
+from .instrumentation import get_observer
+from .static import serve
 from .utils import send_internal_file
 
 
 class CrossDomainMediaMixin:
     media_auth_class = CrossDomainMediaAuth
+    # Serve files from Python instead of an internal redirect
+    # when there is no front server on the media host
+    serve_media_directly = False
 
     def is_media_host(self, mauth):
-        media_host = urlparse(settings.MEDIA_URL).netloc
-        return self.request.get_host() == media_host
+        return self.request.get_host() == get_config().media_host
 
     def invalid_token(self, mauth):
         return HttpResponse(status=403)
@@ -31,12 +35,54 @@ class CrossDomainMediaMixin:
 
     def send_media_file(self, mauth):
         url = mauth.get_authorized_internal_path(self.request)
-        return send_internal_file(url)
+        if self.serve_media_directly:
+            response = serve(
+                self.request, mauth.get_media_file_path(), settings.MEDIA_ROOT
+            )
+        else:
+            response = send_internal_file(url, mauth.get_media_file_path())
+        if not mauth.is_media_public():
+            mauth.set_cache_headers(response, mauth.get_token(self.request))
+        return response
 
     def serve_media(self, mauth):
         url = mauth.get_file_path(self.request)
         return serve(self.request, url, settings.MEDIA_ROOT)
 
+    def dispatch(self, request, *args, **kwargs):
+        if self.media_auth_class.BIND_FILE_PATH:
+            response = self.respond_stateless()
+            if response is not None:
+                return response
+        return super().dispatch(request, *args, **kwargs)
+
+    def respond_stateless(self):
+        """
+        Serve media with a file bound token before any object lookup.
+        Returns None to fall back to the regular flow.
+        """
+        mauth = self.media_auth_class({})
+        if mauth.is_debug() or not self.is_media_host(mauth):
+            return None
+        try:
+            file_path = mauth.get_stateless_file_path(self.request)
+        except ExpiredToken:
+            return None
+        except BadToken:
+            get_observer().count('stateless', 'bad')
+            return self.invalid_token(mauth)
+        if file_path is None:
+            return None
+        get_observer().count('stateless', 'served')
+        response = mauth.send_internal_file(file_path)
+        return mauth.set_cache_headers(response, mauth.get_token(self.request))
+
+    def get(self, request, *args, **kwargs):
+        with get_observer().timer('object_lookup'):
+            self.object = self.get_object()
+        context = self.get_context_data(object=self.object)
+        return self.render_to_response(context)
+
     def render_to_response(self, context):
         mauth = self.media_auth_class(context)
 
@@ -48,10 +94,14 @@ class CrossDomainMediaMixin:
         return self.respond_web(mauth)
 
     def respond_debug(self, mauth):
+        observer = get_observer()
         try:
-            return self.serve_media(mauth)
+            response = self.serve_media(mauth)
         except PermissionDenied:
+            observer.count('debug', 'denied')
             return self.unauthorized(mauth)
+        observer.count('debug', 'served')
+        return response
 
     def respond_media(self, mauth):
         """
@@ -60,14 +110,20 @@ class CrossDomainMediaMixin:
         - deny access
         - redirect back to app for authentication
         """
+        observer = get_observer()
         try:
-            return self.send_media_file(mauth)
+            response = self.send_media_file(mauth)
         except ExpiredToken:
+            observer.count('media', 'expired')
             return self.refresh_token(mauth)
         except MissingToken:
+            observer.count('media', 'missing')
             return self.refresh_token(mauth)
         except BadToken:
+            observer.count('media', 'bad')
             return self.invalid_token(mauth)
+        observer.count('media', 'served')
+        return response
 
     def respond_web(self, mauth):
         """
@@ -77,7 +133,115 @@ class CrossDomainMediaMixin:
         - deny when not authorized
         """
 
+        observer = get_observer()
+        try:
+            response = self.redirect_to_media(mauth)
+        except PermissionDenied:
+            observer.count('web', 'denied')
+            return self.unauthorized(mauth)
+        observer.count('web', 'redirect')
+        return response
+
+
+class AsyncCrossDomainMediaMixin(CrossDomainMediaMixin):
+    """
+    Async variant of CrossDomainMediaMixin to combine
+    with DetailView under ASGI
+    """
+    async def dispatch(self, request, *args, **kwargs):
+        if self.media_auth_class.BIND_FILE_PATH:
+            if self.media_auth_class.VERIFIED_TOKEN_CACHE_ALIAS is not None:
+                response = await sync_to_async(self.respond_stateless)()
+            else:
+                response = self.respond_stateless()
+            if response is not None:
+                return response
+        return await super(CrossDomainMediaMixin, self).dispatch(
+            request, *args, **kwargs
+        )
+
+    async def get(self, request, *args, **kwargs):
+        with get_observer().timer('object_lookup'):
+            self.object = await self.aget_object()
+        context = self.get_context_data(object=self.object)
+        return await self.arender_to_response(context)
+
+    async def aget_object(self, queryset=None):
+        """
+        Async version of SingleObjectMixin.get_object
+        """
+        if queryset is None:
+            queryset = self.get_queryset()
+        pk = self.kwargs.get(self.pk_url_kwarg)
+        slug = self.kwargs.get(self.slug_url_kwarg)
+        if pk is not None:
+            queryset = queryset.filter(pk=pk)
+        if slug is not None and (pk is None or self.query_pk_and_slug):
+            slug_field = self.get_slug_field()
+            queryset = queryset.filter(**{slug_field: slug})
+        if pk is None and slug is None:
+            raise AttributeError(
+                "Generic detail view %s must be called with either an object "
+                "pk or a slug in the URLconf." % self.__class__.__name__
+            )
+        try:
+            return await queryset.aget()
+        except queryset.model.DoesNotExist:
+            raise Http404(
+                _("No %(verbose_name)s found matching the query")
+                % {"verbose_name": queryset.model._meta.verbose_name}
+            )
+
+    async def aredirect_to_media(self, mauth):
+        return redirect(await mauth.aget_authorized_media_url(self.request))
+
+    async def aserve_media(self, mauth):
+        url = await mauth.aget_file_path(self.request)
+        return await sync_to_async(serve)(self.request, url, settings.MEDIA_ROOT)
+
+    async def arender_to_response(self, context):
+        mauth = self.media_auth_class(context)
+
+        if mauth.is_debug():
+            return await self.arespond_debug(mauth)
+
+        if self.is_media_host(mauth):
+            return await self.arespond_media(mauth)
+        return await self.arespond_web(mauth)
+
+    async def arespond_debug(self, mauth):
+        observer = get_observer()
+        try:
+            response = await self.aserve_media(mauth)
+        except PermissionDenied:
+            observer.count('debug', 'denied')
+            return self.unauthorized(mauth)
+        observer.count('debug', 'served')
+        return response
+
+    def media_blocks(self, mauth):
+        """
+        Shared verified token caches and serving files
+        directly do blocking I/O
+        """
+        return (mauth.VERIFIED_TOKEN_CACHE_ALIAS is not None or
+                self.serve_media_directly)
+
+    async def arespond_media(self, mauth):
+        """
+        Plain token checks need no I/O and stay on the event loop,
+        everything else runs the sync flow in a thread
+        """
+        if self.media_blocks(mauth):
+            return await sync_to_async(self.respond_media)(mauth)
+        return self.respond_media(mauth)
+
+    async def arespond_web(self, mauth):
+        observer = get_observer()
         try:
-            return self.redirect_to_media(mauth)
+            response = await self.aredirect_to_media(mauth)
         except PermissionDenied:
+            observer.count('web', 'denied')
             return self.unauthorized(mauth)
+        observer.count('web', 'redirect')
+        return response
@@ -7,8 +7,8 @@ class Attachment(models.Model):
     file = models.FileField()
 
     def get_crossdomain_auth(self):
-        from .views import AttachmentCrossDomainMediaAuth
+        from .views import CustomCrossDomainMediaAuth
 
-        return AttachmentCrossDomainMediaAuth({
+        return CustomCrossDomainMediaAuth({
             'object': self,
         })
@@ -6,6 +6,7 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.staticfiles",
 
+    "crossdomainmedia",
     "tests",
 ]
 
@@ -27,6 +28,13 @@ DATABASES = {
     }
 }
 
+TEMPLATES = [
+    {
+        "BACKEND": "django.template.backends.django.DjangoTemplates",
+        "APP_DIRS": True,
+    },
+]
+
 STATIC_URL = "/static/"
 
 SITE_URL = 'https://www.example.com'
@@ -1,13 +1,49 @@
+import csv
+import io
+import json
 import os
-from urllib.parse import urlparse
+import re
+import threading
+import time
+from unittest import mock
+from urllib.parse import parse_qs, unquote, urlparse, urlsplit
 
+from asgiref.sync import async_to_sync
 from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.test import TestCase, override_settings
+from django.contrib.auth.models import AnonymousUser, Group, Permission
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.template import Context, Template
+from django.core.signing import TimestampSigner
+from django.test import (
+    AsyncRequestFactory,
+    RequestFactory,
+    TestCase,
+    override_settings,
+)
 from django.urls import reverse
 
+from crossdomainmedia import permcache, static
+from crossdomainmedia.auth import BadToken, ExpiredToken
+from crossdomainmedia.conf import get_config
+from crossdomainmedia.handlers import MediaHostASGIMiddleware, MediaHostWSGIMiddleware
+from crossdomainmedia.instrumentation import MetricsCollector, get_observer
+from crossdomainmedia.middleware import SignMediaURLsMiddleware
+from crossdomainmedia.presign import write_signed_urls
+from crossdomainmedia.refresh import refresh_media_urls
+from crossdomainmedia.securelink import SecureLinkCrossDomainMediaAuth
+from crossdomainmedia.signing import PrecomputedTimestampSigner
+
 from .models import Attachment
-from .views import CustomCrossDomainMediaAuth
+from .views import (
+    AsyncAttachmentFileDetailView,
+    AsyncCustomCrossDomainMediaAuth,
+    CustomCrossDomainMediaAuth,
+    StatelessCustomCrossDomainMediaAuth,
+)
 
 User = get_user_model()
 
@@ -217,3 +253,994 @@ class CrossDomainMediaTest(TestCase):
             self.assertIn("Location", response)
             parsed_url = urlparse(response["Location"])
             self.assertEqual(parsed_url.netloc, MEDIA_DOMAIN)
+
+    def test_full_media_urls_batch(self):
+        attachments = [self.public_attachment, self.private_attachment]
+        urls = CustomCrossDomainMediaAuth.get_full_media_urls(
+            attachments, authorized=True
+        )
+        self.assertEqual(len(urls), 2)
+        tokens = set()
+        for attachment, url in zip(attachments, urls):
+            mauth = CustomCrossDomainMediaAuth({"object": attachment})
+            self.assertTrue(url.startswith(mauth.get_full_media_url()))
+            token = parse_qs(urlparse(url).query)["token"][0]
+            mauth.check_token(token)
+            tokens.add(token.split(":")[0])
+        # Whole batch is signed with the same timestamp
+        self.assertEqual(len(tokens), 1)
+
+        urls = CustomCrossDomainMediaAuth.get_full_media_urls(
+            [{"object": self.private_attachment}]
+        )
+        mauth = CustomCrossDomainMediaAuth({"object": self.private_attachment})
+        self.assertEqual(urls, [mauth.get_full_media_url()])
+
+        class MediaURLAuth(CustomCrossDomainMediaAuth):
+            def get_media_url(self):
+                return super().get_media_url() + "/download"
+
+        urls = MediaURLAuth.get_full_media_urls(attachments, authorized=True)
+        for attachment, url in zip(attachments, urls):
+            mauth = MediaURLAuth({"object": attachment})
+            self.assertTrue(url.startswith(mauth.get_full_media_url() + "?"))
+            token = parse_qs(urlparse(url).query)["token"][0]
+            mauth.check_token(token, path=urlparse(url).path)
+
+    def test_signer_is_cached(self):
+        mauth = CustomCrossDomainMediaAuth({"object": self.private_attachment})
+        signer = mauth.get_signer()
+        self.assertIs(signer, mauth.get_signer())
+        self.assertEqual(
+            signer.signature("value"),
+            TimestampSigner().signature("value"),
+        )
+        token = mauth.sign_path(mauth.get_media_url_path())
+        with self.settings(SECRET_KEY="othersecretkey"):
+            self.assertIsNot(signer, mauth.get_signer())
+            with self.assertRaises(BadToken):
+                mauth.check_token(token)
+        mauth.check_token(token)
+
+    def test_overridden_signer(self):
+        class CustomSignerAuth(CustomCrossDomainMediaAuth):
+            def get_signer(self):
+                return TimestampSigner(salt="custom")
+
+        mauth = CustomSignerAuth({"object": self.private_attachment})
+        token = mauth.sign_path(mauth.get_media_url_path())
+        mauth.check_token(token)
+        default_mauth = CustomCrossDomainMediaAuth({"object": self.private_attachment})
+        with self.assertRaises(BadToken):
+            default_mauth.check_token(token)
+        with self.assertRaises(BadToken):
+            mauth.check_token(default_mauth.sign_path(mauth.get_media_url_path()))
+
+    def test_bucketed_token(self):
+        class BucketedAuth(CustomCrossDomainMediaAuth):
+            TOKEN_BUCKET_SECONDS = 60
+
+        mauth = BucketedAuth({"object": self.private_attachment})
+        path = mauth.get_media_url_path()
+        with mock.patch("time.time", return_value=1000):
+            token = mauth.sign_path(path)
+        with mock.patch("time.time", return_value=1019):
+            self.assertEqual(mauth.sign_path(path), token)
+        with mock.patch("time.time", return_value=1020):
+            self.assertNotEqual(mauth.sign_path(path), token)
+
+        # Bucket started at 960, grace window adds one bucket
+        with mock.patch("time.time", return_value=960 + 120 + 60):
+            mauth.check_token(token)
+        with mock.patch("time.time", return_value=960 + 120 + 61):
+            with self.assertRaises(ExpiredToken):
+                mauth.check_token(token)
+
+    def test_stateless_media_host(self):
+        loggedin = self.client.login(username="superuser", password="password")
+        self.assertTrue(loggedin)
+        stateless_url = reverse(
+            "attachment_file_stateless", kwargs={"name": "private.txt"}
+        )
+        response = self.client.get(stateless_url, HTTP_HOST=settings.SITE_DOMAIN)
+        self.assertEqual(response.status_code, 302)
+        url = response["Location"]
+        self.assertIn("token=", url)
+
+        self.client.logout()
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_HOST=settings.MEDIA_DOMAIN)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response["X-Accel-Redirect"],
+            "%s%s"
+            % (settings.INTERNAL_MEDIA_PREFIX, self.private_attachment.file.name),
+        )
+
+        response = self.client.get(url + "a", HTTP_HOST=settings.MEDIA_DOMAIN)
+        self.assertEqual(response.status_code, 403)
+
+        # Missing token falls back to the regular flow
+        response = self.client.get(stateless_url, HTTP_HOST=settings.MEDIA_DOMAIN)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(
+            response["Location"], "%s%s" % (settings.SITE_URL, stateless_url)
+        )
+
+        # reverse() and the request path quote ; and = differently
+        for name in ("a=b.txt", "a;b.txt"):
+            attachment = Attachment.objects.create(
+                name=name, public=False, file="test_files/test-private.txt"
+            )
+            mauth = StatelessCustomCrossDomainMediaAuth({"object": attachment})
+            url = mauth.get_full_media_url(authorized=True)
+            with self.assertNumQueries(0):
+                response = self.client.get(url, HTTP_HOST=settings.MEDIA_DOMAIN)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(
+                response["X-Accel-Redirect"],
+                "%s%s" % (settings.INTERNAL_MEDIA_PREFIX, attachment.file.name),
+            )
+
+    def test_verified_token_cache(self):
+        class CachingAuth(CustomCrossDomainMediaAuth):
+            VERIFIED_TOKEN_CACHE_SIZE = 1
+
+        mauth = CachingAuth({"object": self.private_attachment})
+        path = mauth.get_media_url_path()
+        with mock.patch("time.time", return_value=1000):
+            token = mauth.sign_path(path)
+            other_token = mauth.sign_path("/other/")
+            value = mauth.check_token(token)
+            with mock.patch.object(
+                PrecomputedTimestampSigner, "unsign", autospec=True,
+                side_effect=PrecomputedTimestampSigner.unsign,
+            ) as unsign:
+                self.assertEqual(mauth.check_token(token), value)
+                self.assertFalse(unsign.called)
+                mauth.check_token(other_token, path="/other/")
+                self.assertEqual(unsign.call_count, 1)
+                # Least recently used entry has been evicted
+                self.assertEqual(mauth.check_token(token), value)
+                self.assertEqual(unsign.call_count, 2)
+        with mock.patch("time.time", return_value=1000 + 121):
+            with self.assertRaises(ExpiredToken):
+                mauth.check_token(other_token, path="/other/")
+
+    def test_verified_token_cache_shared_scope(self):
+        class SharedAuth(CustomCrossDomainMediaAuth):
+            VERIFIED_TOKEN_CACHE_ALIAS = "default"
+
+        class ShortSharedAuth(SharedAuth):
+            TOKEN_MAX_AGE_SECONDS = 10
+
+        cache.clear()
+        mauth = SharedAuth({"object": self.private_attachment})
+        short_mauth = ShortSharedAuth({"object": self.private_attachment})
+        with mock.patch("time.time", return_value=1000):
+            token = mauth.sign_path(mauth.get_media_url_path())
+        with mock.patch("time.time", return_value=1050):
+            mauth.check_token(token)
+            # Another class sharing the cache verifies on its own
+            with self.assertRaises(ExpiredToken):
+                short_mauth.check_token(token)
+            # So does the same class after the key changed
+            with override_settings(SECRET_KEY="rotated"):
+                with self.assertRaises(BadToken):
+                    mauth.check_token(token)
+
+    async def test_async_view(self):
+        view = AsyncAttachmentFileDetailView.as_view()
+        factory = AsyncRequestFactory()
+
+        async def get(url, host, user):
+            request = factory.get(url)
+            request.META["HTTP_HOST"] = host
+
+            async def auser():
+                return user
+
+            request.user = user
+            request.auser = auser
+            return await view(request, name="private.txt")
+
+        private_url = reverse("attachment_file_async", kwargs={"name": "private.txt"})
+        response = await get(private_url, settings.SITE_DOMAIN, AnonymousUser())
+        self.assertEqual(response.status_code, 403)
+
+        response = await get(private_url, settings.SITE_DOMAIN, self.superuser)
+        self.assertEqual(response.status_code, 302)
+        url = response["Location"]
+        self.assertIn("token=", url)
+
+        response = await get(url, settings.MEDIA_DOMAIN, AnonymousUser())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response["X-Accel-Redirect"],
+            "%s%s"
+            % (settings.INTERNAL_MEDIA_PREFIX, self.private_attachment.file.name),
+        )
+
+        response = await get(url + "a", settings.MEDIA_DOMAIN, AnonymousUser())
+        self.assertEqual(response.status_code, 403)
+
+    async def test_async_view_blocking_io(self):
+        class SharedCacheAuth(AsyncCustomCrossDomainMediaAuth):
+            VERIFIED_TOKEN_CACHE_ALIAS = "default"
+
+        class SharedCacheView(AsyncAttachmentFileDetailView):
+            media_auth_class = SharedCacheAuth
+
+        class DirectView(AsyncAttachmentFileDetailView):
+            serve_media_directly = True
+
+        loop_thread = threading.get_ident()
+        threads = []
+        check_token = CustomCrossDomainMediaAuth.check_token
+
+        def record_thread(mauth, *args, **kwargs):
+            threads.append(threading.get_ident())
+            return check_token(mauth, *args, **kwargs)
+
+        factory = AsyncRequestFactory()
+        for view_class, auth_class in (
+            (SharedCacheView, SharedCacheAuth),
+            (DirectView, AsyncCustomCrossDomainMediaAuth),
+        ):
+            mauth = auth_class({"object": self.private_attachment})
+            request = factory.get(mauth.get_full_media_url(authorized=True))
+            request.META["HTTP_HOST"] = settings.MEDIA_DOMAIN
+            request.user = AnonymousUser()
+            with mock.patch.object(
+                CustomCrossDomainMediaAuth, "check_token", record_thread
+            ), override_settings(MEDIA_ROOT=os.path.dirname(__file__)):
+                response = await view_class.as_view()(
+                    request, name="private.txt"
+                )
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn(loop_thread, threads)
+        self.assertEqual(b"".join(response.streaming_content), b"private")
+
+    def test_authorized_media_urls_batch(self):
+        attachments = [self.public_attachment, self.private_attachment]
+        request = RequestFactory().get("/")
+        request.user = AnonymousUser()
+        with mock.patch.object(
+            CustomCrossDomainMediaAuth,
+            "filter_permitted",
+            wraps=CustomCrossDomainMediaAuth.filter_permitted,
+        ) as filter_permitted:
+            urls = CustomCrossDomainMediaAuth.get_authorized_media_urls(
+                request, attachments
+            )
+        self.assertEqual(filter_permitted.call_count, 1)
+        public_mauth = CustomCrossDomainMediaAuth({"object": self.public_attachment})
+        self.assertEqual(urls, [public_mauth.get_full_media_url(), None])
+
+        request.user = self.superuser
+        urls = CustomCrossDomainMediaAuth.get_authorized_media_urls(
+            request, attachments
+        )
+        self.assertNotIn("token=", urls[0])
+        self.assertIn("token=", urls[1])
+
+    def test_media_host_middleware(self):
+        mauth = StatelessCustomCrossDomainMediaAuth({"object": self.private_attachment})
+        url = urlparse(mauth.get_full_media_url(authorized=True))
+
+        def app(environ, start_response):
+            start_response("200 OK", [])
+            return [b"django"]
+
+        middleware = MediaHostWSGIMiddleware(
+            app, StatelessCustomCrossDomainMediaAuth, prefix="/attachment-stateless/"
+        )
+
+        def call(query_string, host=settings.MEDIA_DOMAIN, path=url.path):
+            environ = {
+                "HTTP_HOST": host,
+                "PATH_INFO": path,
+                "QUERY_STRING": query_string,
+            }
+            result = {}
+
+            def start_response(status, headers):
+                result["status"] = status
+                result["headers"] = dict(headers)
+
+            result["body"] = b"".join(middleware(environ, start_response))
+            return result
+
+        result = call(url.query)
+        self.assertEqual(result["status"], "200 OK")
+        self.assertEqual(
+            result["headers"]["X-Accel-Redirect"],
+            "%s%s"
+            % (settings.INTERNAL_MEDIA_PREFIX, self.private_attachment.file.name),
+        )
+        self.assertEqual(call(url.query + "a")["status"], "403 Forbidden")
+        self.assertEqual(call("")["body"], b"django")
+        self.assertEqual(call(url.query, host=settings.SITE_DOMAIN)["body"], b"django")
+
+        sent = []
+
+        async def asgi_app(scope, receive, send):
+            sent.append("django")
+
+        async def send(message):
+            sent.append(message)
+
+        asgi_middleware = MediaHostASGIMiddleware(
+            asgi_app,
+            StatelessCustomCrossDomainMediaAuth,
+            prefix="/attachment-stateless/",
+        )
+        scope = {
+            "type": "http",
+            "path": url.path,
+            "query_string": url.query.encode(),
+            "headers": [(b"host", settings.MEDIA_DOMAIN.encode())],
+        }
+        async_to_sync(asgi_middleware)(scope, None, send)
+        self.assertEqual(sent[0]["status"], 200)
+        self.assertIn(
+            (
+                b"X-Accel-Redirect",
+                (
+                    settings.INTERNAL_MEDIA_PREFIX + self.private_attachment.file.name
+                ).encode(),
+            ),
+            sent[0]["headers"],
+        )
+        async_to_sync(asgi_middleware)(dict(scope, query_string=b""), None, send)
+        self.assertEqual(sent[-1], "django")
+
+        # Servers pass the unquoted path, reverse() leaves ; and = as is
+        for name in ("a=b.txt", "a;b.txt"):
+            attachment = Attachment(name=name, file="test_files/test-private.txt")
+            mauth = StatelessCustomCrossDomainMediaAuth({"object": attachment})
+            url = urlsplit(mauth.get_full_media_url(authorized=True))
+            path = unquote(url.path)
+            self.assertEqual(call(url.query, path=path)["status"], "200 OK")
+            async_to_sync(asgi_middleware)(
+                dict(scope, path=path, query_string=url.query.encode()),
+                None,
+                send,
+            )
+            self.assertEqual(sent[-2]["status"], 200)
+
+    def test_secure_link_token(self):
+        class SecureLinkAuth(SecureLinkCrossDomainMediaAuth, CustomCrossDomainMediaAuth):
+            SECURE_LINK_SECRET = "nginxsecret"
+
+        mauth = SecureLinkAuth({"object": self.private_attachment})
+        with mock.patch("time.time", return_value=1000):
+            url = mauth.get_full_media_url(authorized=True)
+        query = parse_qs(urlparse(url).query)
+        self.assertEqual(query["expires"], ["1120"])
+        # echo -n '1120/attachment/private.txt nginxsecret' | openssl md5 -binary
+        # | openssl base64 | tr +/ -_ | tr -d =
+        self.assertEqual(query["md5"], ["8RZ61FzQG3GXorHn_iBAdQ"])
+
+        request = RequestFactory().get(url)
+        with mock.patch("time.time", return_value=1120):
+            mauth.check_token_request(request)
+        with mock.patch("time.time", return_value=1121):
+            with self.assertRaises(ExpiredToken):
+                mauth.check_token_request(request)
+        request = RequestFactory().get(url.replace("1120", "1121"))
+        with self.assertRaises(BadToken):
+            mauth.check_token_request(request)
+
+        config = SecureLinkAuth.get_nginx_config("/attachment/", "/var/www/media/")
+        self.assertIn('secure_link_md5 "$secure_link_expires$uri nginxsecret";', config)
+        self.assertIn("secure_link $arg_md5,$arg_expires;", config)
+
+    @override_settings(
+        CROSSDOMAINMEDIA_OBSERVER="crossdomainmedia.instrumentation.MetricsCollector"
+    )
+    def test_instrumentation(self):
+        observer = get_observer()
+        self.assertIsInstance(observer, MetricsCollector)
+
+        response = self.client.get(self.private_url, HTTP_HOST=settings.SITE_DOMAIN)
+        self.assertEqual(response.status_code, 403)
+        self.client.login(username="superuser", password="password")
+        response = self.client.get(self.private_url, HTTP_HOST=settings.SITE_DOMAIN)
+        url = response["Location"]
+        self.client.get(url, HTTP_HOST=settings.MEDIA_DOMAIN)
+        self.client.get(url + "a", HTTP_HOST=settings.MEDIA_DOMAIN)
+        self.client.get(self.private_url, HTTP_HOST=settings.MEDIA_DOMAIN)
+
+        self.assertEqual(
+            observer.counters,
+            {
+                ("web", "denied"): 1,
+                ("web", "redirect"): 1,
+                ("media", "served"): 1,
+                ("media", "bad"): 1,
+                ("media", "missing"): 1,
+            },
+        )
+        self.assertEqual(observer.histograms["object_lookup"]["count"], 5)
+        self.assertEqual(observer.histograms["has_perm"]["count"], 2)
+        self.assertEqual(observer.histograms["sign"]["count"], 1)
+        self.assertEqual(observer.histograms["check_token"]["count"], 3)
+
+        metrics = observer.render()
+        self.assertIn(
+            'crossdomainmedia_responses_total{flow="media",outcome="bad"} 1', metrics
+        )
+        self.assertIn(
+            'crossdomainmedia_duration_seconds_bucket{operation="sign",le="+Inf"} 1',
+            metrics,
+        )
+
+    def test_internal_redirect_backends(self):
+        mauth = CustomCrossDomainMediaAuth({"object": self.private_attachment})
+        file_name = self.private_attachment.file.name
+        with self.settings(CROSSDOMAINMEDIA_INTERNAL_REDIRECT="apache"):
+            response = mauth.send_internal_file()
+            self.assertNotIn("X-Accel-Redirect", response)
+            self.assertEqual(
+                response["X-Sendfile"], os.path.join(settings.MEDIA_ROOT, file_name)
+            )
+            self.assertEqual(response["Content-Type"], "text/plain")
+
+        with self.settings(CROSSDOMAINMEDIA_INTERNAL_REDIRECT="litespeed"):
+            response = mauth.send_internal_file()
+            self.assertEqual(
+                response["X-LiteSpeed-Location"],
+                "%s%s" % (settings.INTERNAL_MEDIA_PREFIX, file_name),
+            )
+
+        response = mauth.send_internal_file()
+        self.assertEqual(
+            response["X-Accel-Redirect"],
+            "%s%s" % (settings.INTERNAL_MEDIA_PREFIX, file_name),
+        )
+
+    def test_static_serve(self):
+        factory = RequestFactory()
+        root = os.path.dirname(__file__)
+        path = self.private_attachment.file.name
+
+        response = static.serve(factory.get("/"), path, root)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b"".join(response.streaming_content), b"private")
+        self.assertEqual(response["Accept-Ranges"], "bytes")
+        etag = response["ETag"]
+        last_modified = response["Last-Modified"]
+
+        with mock.patch("builtins.open") as mocked_open:
+            response = static.serve(
+                factory.get("/", HTTP_IF_NONE_MATCH=etag), path, root
+            )
+            self.assertEqual(response.status_code, 304)
+            response = static.serve(
+                factory.get("/", HTTP_IF_MODIFIED_SINCE=last_modified), path, root
+            )
+            self.assertEqual(response.status_code, 304)
+            self.assertFalse(mocked_open.called)
+
+        for header, status, content_range, content in (
+            ("bytes=1-3", 206, "bytes 1-3/7", b"riv"),
+            ("bytes=4-", 206, "bytes 4-6/7", b"ate"),
+            ("bytes=-2", 206, "bytes 5-6/7", b"te"),
+            ("bytes=7-", 416, "bytes */7", None),
+        ):
+            response = static.serve(factory.get("/", HTTP_RANGE=header), path, root)
+            self.assertEqual(response.status_code, status)
+            self.assertEqual(response["Content-Range"], content_range)
+            if content is not None:
+                self.assertEqual(response["Content-Length"], str(len(content)))
+                self.assertEqual(b"".join(response.streaming_content), content)
+
+        response = static.serve(
+            factory.get("/", HTTP_RANGE="bytes=1-3", HTTP_IF_RANGE='"other"'),
+            path,
+            root,
+        )
+        self.assertEqual(response.status_code, 200)
+        response.close()
+
+        with self.assertRaises(Http404):
+            static.serve(factory.get("/"), "../tests.py", os.path.join(root, "test_files"))
+
+    def test_internal_redirect_cache_headers(self):
+        loggedin = self.client.login(username="superuser", password="password")
+        self.assertTrue(loggedin)
+        with mock.patch("time.time", return_value=1000):
+            response = self.client.get(self.private_url, HTTP_HOST=settings.SITE_DOMAIN)
+        url = response["Location"]
+        with mock.patch("time.time", return_value=1030):
+            response = self.client.get(url, HTTP_HOST=settings.MEDIA_DOMAIN)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Cache-Control"], "private, max-age=90")
+        self.assertEqual(response["X-Accel-Expires"], "90")
+        self.assertNotIn("X-Accel-Buffering", response)
+
+        class ThrottledAuth(CustomCrossDomainMediaAuth):
+            INTERNAL_BUFFERING = False
+            INTERNAL_LIMIT_RATE = 1024
+
+        mauth = ThrottledAuth({"object": self.private_attachment})
+        with mock.patch("time.time", return_value=1000):
+            token = mauth.sign_path(mauth.get_media_url_path())
+            response = mauth.set_cache_headers(mauth.send_internal_file(), token)
+        self.assertEqual(response["X-Accel-Buffering"], "no")
+        self.assertEqual(response["X-Accel-Limit-Rate"], "1024")
+
+        response = self.client.get(self.public_url, HTTP_HOST=settings.MEDIA_DOMAIN)
+        self.assertNotIn("Cache-Control", response)
+
+    def test_refresh_media_urls(self):
+        refresh_url = reverse("media_refresh")
+        mauth = CustomCrossDomainMediaAuth({"object": self.private_attachment})
+        private_media_url = mauth.get_full_media_url(authorized=True)
+        urls = [private_media_url, self.public_url, "/unknown/"]
+
+        def refresh(urls):
+            return self.client.post(
+                refresh_url,
+                json.dumps({"urls": urls}),
+                content_type="application/json",
+                HTTP_HOST=settings.SITE_DOMAIN,
+            )
+
+        response = refresh(urls)
+        self.assertEqual(response.status_code, 200)
+        public_mauth = CustomCrossDomainMediaAuth({"object": self.public_attachment})
+        self.assertEqual(
+            response.json()["urls"],
+            {
+                private_media_url: None,
+                self.public_url: public_mauth.get_full_media_url(),
+                "/unknown/": None,
+            },
+        )
+
+        self.client.login(username="superuser", password="password")
+        response = refresh(urls)
+        fresh_url = response.json()["urls"][private_media_url]
+        self.assertTrue(fresh_url.startswith(mauth.get_full_media_url() + "?token="))
+        token = parse_qs(urlparse(fresh_url).query)["token"][0]
+        mauth.check_token(token)
+
+        # Async views that only implement aget_object
+        async_mauth = AsyncCustomCrossDomainMediaAuth(
+            {"object": self.private_attachment}
+        )
+        async_media_url = async_mauth.get_full_media_url()
+        response = refresh([async_media_url])
+        self.assertEqual(response.status_code, 200)
+        fresh_url = response.json()["urls"][async_media_url]
+        self.assertTrue(fresh_url.startswith(async_media_url + "?token="))
+
+        self.assertEqual(refresh("nope").status_code, 400)
+        self.assertEqual(refresh(["/"] * 501).status_code, 400)
+
+    def test_prefix_scoped_token(self):
+        class NoPrefixAuth(CustomCrossDomainMediaAuth):
+            PREFIX_SCOPED_TOKENS = True
+
+        class PrefixAuth(NoPrefixAuth):
+            def get_token_prefix(self, path):
+                return path[:path.rfind("/") + 1]
+
+        # The prefix must be chosen, a default would widen access
+        mauth = NoPrefixAuth({"object": self.private_attachment})
+        with self.assertRaises(NotImplementedError):
+            mauth.sign_path(mauth.get_media_url_path())
+
+        mauth = PrefixAuth({"object": self.private_attachment})
+        with mock.patch("time.time", return_value=time.time()):
+            token = mauth.sign_path(mauth.get_media_url_path())
+            self.assertEqual(token, mauth.sign_path("/attachment/"))
+        mauth.check_token(token)
+        mauth.check_token(token, path="/attachment/other.txt")
+        mauth.check_token(token, path="/attachment/sub/dir/file.txt")
+        with self.assertRaises(BadToken):
+            mauth.check_token(token, path="/other/file.txt")
+
+        # Widening the prefix breaks the signature
+        widened = ":".join(["Lw"] + token.split(":")[1:])
+        with self.assertRaises(BadToken):
+            mauth.check_token(widened, path="/other/file.txt")
+
+    def test_media_url_template_tag(self):
+        template = Template(
+            "{% load crossdomainmedia %}"
+            "{% prefetch_media_urls attachments %}"
+            "{% for attachment in attachments %}"
+            "[{% media_url attachment %}]"
+            "{% endfor %}"
+            "[{% media_url private %}]"
+        )
+        attachments = [self.public_attachment, self.private_attachment]
+        request = RequestFactory().get("/")
+        request.user = AnonymousUser()
+        public_url = self.public_attachment.get_crossdomain_auth().get_full_media_url()
+        rendered = template.render(
+            Context(
+                {
+                    "request": request,
+                    "attachments": attachments,
+                    "private": self.private_attachment,
+                }
+            )
+        )
+        self.assertEqual(rendered, "[%s][][]" % public_url)
+
+        request = RequestFactory().get("/")
+        request.user = self.superuser
+        with mock.patch.object(
+            CustomCrossDomainMediaAuth,
+            "get_authorized_media_urls",
+            wraps=CustomCrossDomainMediaAuth.get_authorized_media_urls,
+        ) as get_urls:
+            rendered = template.render(
+                Context(
+                    {
+                        "request": request,
+                        "attachments": attachments,
+                        "private": Attachment.objects.get(pk=self.private_attachment.pk),
+                    }
+                )
+            )
+        self.assertEqual(get_urls.call_count, 1)
+        urls = rendered[1:-1].split("][")
+        self.assertEqual(urls[0], public_url)
+        self.assertIn("token=", urls[1])
+        self.assertEqual(urls[1], urls[2])
+
+    def test_config_snapshot(self):
+        config = get_config()
+        self.assertIs(config, get_config())
+        self.assertEqual(config.media_host, settings.MEDIA_DOMAIN)
+        self.assertEqual(config.media_origin, "https://" + settings.MEDIA_DOMAIN)
+        self.assertEqual(config.internal_prefix, settings.INTERNAL_MEDIA_PREFIX)
+        mauth = CustomCrossDomainMediaAuth({"object": self.private_attachment})
+        self.assertFalse(mauth.is_debug())
+        with self.settings(DEBUG=True, MEDIA_URL="/media/"):
+            self.assertIsNot(config, get_config())
+            self.assertEqual(get_config().media_host, "")
+            self.assertTrue(mauth.is_debug())
+
+    def test_sign_media_urls_middleware(self):
+        origin = "https://" + settings.MEDIA_DOMAIN
+        private_media_url = origin + self.private_url
+        public_media_url = origin + self.public_url
+        content = (
+            '<a href="{0}">a</a><img src="{0}"><a href="{1}">b</a>'
+            '<a href="{0}?download=1">c</a><a href="{2}/unknown/">d</a>'
+        ).format(private_media_url, public_media_url, origin)
+        request = RequestFactory().get("/")
+        request.user = self.superuser
+
+        middleware = SignMediaURLsMiddleware(lambda request: HttpResponse(content))
+        response = middleware(request)
+        rewritten = response.content.decode()
+        mauth = CustomCrossDomainMediaAuth({"object": self.private_attachment})
+        signed_urls = re.findall(r'"(%s\?token=[^"]+)"' % re.escape(private_media_url), rewritten)
+        self.assertEqual(len(signed_urls), 2)
+        self.assertEqual(signed_urls[0], signed_urls[1])
+        mauth.check_token(parse_qs(urlparse(signed_urls[0]).query)["token"][0])
+        self.assertIn('href="%s"' % public_media_url, rewritten)
+        self.assertIn('href="%s?download=1"' % private_media_url, rewritten)
+        self.assertIn('href="%s/unknown/"' % origin, rewritten)
+
+        encoded = content.encode()
+        chunks = [encoded[i : i + 3] for i in range(0, len(encoded), 3)]
+        middleware = SignMediaURLsMiddleware(
+            lambda request: StreamingHttpResponse(iter(chunks))
+        )
+        with mock.patch(
+            "crossdomainmedia.middleware.refresh_media_urls",
+            wraps=refresh_media_urls,
+        ) as refresh:
+            response = middleware(request)
+            streamed = b"".join(response.streaming_content).decode()
+        # URLs signed for the first response are memoized on the request
+        self.assertEqual(streamed, rewritten)
+        self.assertEqual(refresh.call_count, 0)
+
+        request = RequestFactory().get("/")
+        request.user = AnonymousUser()
+        response = middleware(request)
+        streamed = b"".join(response.streaming_content).decode()
+        self.assertEqual(streamed, content)
+
+    def test_sign_media_urls_middleware_skips(self):
+        origin = "https://" + settings.MEDIA_DOMAIN
+        private_media_url = origin + self.private_url
+        request = RequestFactory().get("/")
+        request.user = self.superuser
+        # Non-ASCII characters end the URL instead of failing
+        content = '<a href="{0}café.png">a</a> {0}” <a href="{0}">b</a>'.format(
+            private_media_url
+        )
+        middleware = SignMediaURLsMiddleware(lambda request: HttpResponse(content))
+        rewritten = middleware(request).content.decode()
+        self.assertIn('href="%scafé.png"' % private_media_url, rewritten)
+        self.assertRegex(rewritten, r" %s\?token=[^” ]+” " % re.escape(private_media_url))
+        self.assertIn('href="%s?token=' % private_media_url, rewritten)
+
+        # Longer host names starting with the media domain are not media URLs
+        content = '<a href="{0}.evil.com{1}">a</a><a href="{0}{1}">b</a>'.format(
+            origin, self.private_url
+        )
+        encoded = content.encode()
+        for chunk_size in (len(encoded), 3, len(origin)):
+            chunks = [
+                encoded[i : i + chunk_size]
+                for i in range(0, len(encoded), chunk_size)
+            ]
+            middleware = SignMediaURLsMiddleware(
+                lambda request: StreamingHttpResponse(iter(chunks))
+            )
+            rewritten = b"".join(middleware(request).streaming_content).decode()
+            self.assertIn(
+                'href="%s.evil.com%s"' % (origin, self.private_url), rewritten
+            )
+            self.assertIn('href="%s?token=' % private_media_url, rewritten)
+
+        # Served files and media host responses are left alone
+        html = private_media_url.encode()
+        middleware = SignMediaURLsMiddleware(
+            lambda request: FileResponse(io.BytesIO(html), content_type="text/html")
+        )
+        response = middleware(request)
+        self.assertEqual(b"".join(response.streaming_content), html)
+        middleware = SignMediaURLsMiddleware(lambda request: HttpResponse(html))
+        request = RequestFactory().get("/", HTTP_HOST=settings.MEDIA_DOMAIN)
+        request.user = self.superuser
+        self.assertEqual(middleware(request).content, html)
+
+    @override_settings(CROSSDOMAINMEDIA_PERMISSION_CACHES={"default": ["tests.Attachment"]})
+    def test_permission_cache(self):
+        class CachedAuth(CustomCrossDomainMediaAuth):
+            PERMISSION_CACHE_TIMEOUT = 60
+
+        cache.clear()
+        user = User.objects.create(username="user")
+        request = RequestFactory().get("/")
+        request.user = user
+        mauth = CachedAuth({"object": self.private_attachment})
+        with mock.patch.object(User, "has_perm", return_value=True) as has_perm:
+            self.assertTrue(mauth.timed_has_perm(request))
+            self.assertTrue(mauth.timed_has_perm(request))
+            self.assertEqual(has_perm.call_count, 1)
+
+            self.private_attachment.save()
+            self.assertTrue(mauth.timed_has_perm(request))
+            self.assertEqual(has_perm.call_count, 2)
+
+            user.user_permissions.add(Permission.objects.first())
+            self.assertTrue(mauth.timed_has_perm(request))
+            self.assertEqual(has_perm.call_count, 3)
+
+            Group.objects.create(name="group").permissions.add(
+                Permission.objects.first()
+            )
+            self.assertTrue(mauth.timed_has_perm(request))
+            self.assertEqual(has_perm.call_count, 4)
+
+        class UnregisteredAuth(CachedAuth):
+            PERMISSION_CACHE_ALIAS = "other"
+
+        with self.assertRaises(ImproperlyConfigured):
+            UnregisteredAuth({"object": self.private_attachment}).timed_has_perm(
+                request
+            )
+
+    @override_settings(CROSSDOMAINMEDIA_PERMISSION_CACHES={"default": ["tests.Attachment"]})
+    def test_permission_cache_revoke_in_fresh_process(self):
+        class CachedAuth(CustomCrossDomainMediaAuth):
+            PERMISSION_CACHE_TIMEOUT = 60
+
+        cache.clear()
+        user = User.objects.create(username="user")
+        permission = Permission.objects.get(codename="view_attachment")
+        user.user_permissions.add(permission)
+        mauth = CachedAuth({"object": self.private_attachment})
+
+        def has_perm():
+            request = RequestFactory().get("/")
+            # Fresh user without the permission cache of ModelBackend
+            request.user = User.objects.get(pk=user.pk)
+            return mauth.timed_has_perm(request)
+
+        # ModelBackend has no object permissions, grant them for any object
+        with mock.patch(
+            "django.contrib.auth.backends.ModelBackend.has_perm",
+            lambda backend, user_obj, perm, obj=None: perm in user_obj.get_all_permissions(),
+        ):
+            self.assertTrue(has_perm())
+            # Another process that has not cached anything yet
+            permcache._registry = None
+            user.user_permissions.remove(permission)
+            self.assertFalse(has_perm())
+
+    def test_signing_key_ids(self):
+        mauth = CustomCrossDomainMediaAuth({"object": self.private_attachment})
+        path = mauth.get_media_url_path()
+        legacy_token = mauth.sign_path(path)
+        keys = {"new": "new-signing-key", "old": "old-signing-key"}
+        with override_settings(
+            CROSSDOMAINMEDIA_SIGNING_KEYS=keys, CROSSDOMAINMEDIA_SIGNING_KEY_ID="old"
+        ):
+            old_token = mauth.sign_path(path)
+        self.assertTrue(old_token.startswith("old:"))
+
+        with override_settings(
+            CROSSDOMAINMEDIA_SIGNING_KEYS=keys, CROSSDOMAINMEDIA_SIGNING_KEY_ID="new"
+        ):
+            new_token = mauth.sign_path(path)
+            self.assertTrue(new_token.startswith("new:"))
+            with mock.patch.object(
+                PrecomputedTimestampSigner, "signature", autospec=True,
+                side_effect=PrecomputedTimestampSigner.signature,
+            ) as signature:
+                mauth.check_token(old_token)
+                mauth.check_token(new_token)
+                mauth.check_token(legacy_token)
+            # One HMAC per token, no trying of other keys
+            self.assertEqual(signature.call_count, 3)
+            with self.assertRaises(BadToken):
+                mauth.check_token("new:" + old_token[len("old:"):])
+
+            stateless = StatelessCustomCrossDomainMediaAuth(
+                {"object": self.private_attachment}
+            )
+            stateless_path = stateless.get_media_url_path()
+            self.assertEqual(
+                stateless.check_file_token(
+                    stateless_path, stateless.sign_path(stateless_path)
+                ),
+                self.private_attachment.file.name,
+            )
+
+        with override_settings(CROSSDOMAINMEDIA_SIGNING_KEYS={"new": "new-signing-key"}):
+            mauth.check_token(new_token)
+            with self.assertRaises(BadToken):
+                mauth.check_token(old_token)
+
+    def test_compact_tokens(self):
+        class CompactAuth(CustomCrossDomainMediaAuth):
+            COMPACT_TOKENS = True
+
+        class CompactStatelessAuth(StatelessCustomCrossDomainMediaAuth):
+            COMPACT_TOKENS = True
+            COMPACT_DIGEST = "sha256"
+            COMPACT_MAC_LENGTH = 16
+
+        mauth = CompactAuth({"object": self.private_attachment})
+        path = mauth.get_media_url_path()
+        with mock.patch("time.time", return_value=1000):
+            token = mauth.sign_path(path)
+            self.assertLess(
+                len(token),
+                len(CustomCrossDomainMediaAuth({}).sign_path(path)),
+            )
+            self.assertEqual(mauth.check_token(token), path)
+            self.assertEqual(mauth.get_token_expiry(token), 1000 + 120)
+            with self.assertRaises(BadToken):
+                mauth.check_token(token, path="/other/")
+            with self.assertRaises(BadToken):
+                mauth.check_token(token[:-2])
+
+            stateless = CompactStatelessAuth({"object": self.private_attachment})
+            stateless_path = stateless.get_media_url_path()
+            self.assertEqual(
+                stateless.check_file_token(
+                    stateless_path, stateless.sign_path(stateless_path)
+                ),
+                self.private_attachment.file.name,
+            )
+        with mock.patch("time.time", return_value=1000 + 121):
+            with self.assertRaises(ExpiredToken):
+                mauth.check_token(token)
+
+    def test_presign_media_urls(self):
+        stdout = io.StringIO()
+        call_command(
+            "presign_media_urls",
+            "tests.Attachment",
+            "tests.views.CustomCrossDomainMediaAuth",
+            "--workers=0",
+            stdout=stdout,
+            stderr=io.StringIO(),
+        )
+        rows = [json.loads(line) for line in stdout.getvalue().splitlines()]
+        self.assertEqual(
+            [row["pk"] for row in rows],
+            [self.public_attachment.pk, self.private_attachment.pk],
+        )
+        self.assertEqual(rows[0]["url"], "https://" + settings.MEDIA_DOMAIN + self.public_url)
+        mauth = CustomCrossDomainMediaAuth({"object": self.private_attachment})
+        mauth.check_token(parse_qs(urlparse(rows[1]["url"]).query)["token"][0])
+
+        output = io.StringIO()
+        count = write_signed_urls(
+            CustomCrossDomainMediaAuth,
+            Attachment.objects.order_by("pk"),
+            output,
+            format="csv",
+            chunk_size=1,
+            workers=2,
+        )
+        self.assertEqual(count, 2)
+        csv_rows = list(csv.DictReader(io.StringIO(output.getvalue())))
+        self.assertEqual([row["url"] for row in csv_rows][0], rows[0]["url"])
+        mauth.check_token(parse_qs(urlparse(csv_rows[1]["url"]).query)["token"][0])
+
+        class LocalAuth(CustomCrossDomainMediaAuth):
+            pass
+
+        output = io.StringIO()
+        with self.assertRaisesMessage(ValueError, "workers=0"):
+            write_signed_urls(LocalAuth, Attachment.objects.all(), output, workers=2)
+        self.assertEqual(output.getvalue(), "")
+        self.assertEqual(
+            write_signed_urls(LocalAuth, Attachment.objects.all(), output, workers=0),
+            2,
+        )
+        with mock.patch("os.cpu_count", return_value=1), mock.patch(
+            "crossdomainmedia.presign.ProcessPoolExecutor"
+        ) as executor:
+            write_signed_urls(LocalAuth, Attachment.objects.all(), io.StringIO())
+        self.assertFalse(executor.called)
+
+    def test_signed_url_cache(self):
+        class CachedURLAuth(CustomCrossDomainMediaAuth):
+            SIGNED_URL_CACHE_ALIAS = "default"
+            TOKEN_BUCKET_SECONDS = 60
+
+        cache.clear()
+        with mock.patch.object(
+            CachedURLAuth, "add_token", autospec=True,
+            side_effect=CustomCrossDomainMediaAuth.add_token,
+        ) as add_token:
+            with mock.patch("time.time", return_value=1200):
+                url = CachedURLAuth(
+                    {"object": self.private_attachment}
+                ).get_full_media_url(authorized=True)
+            with mock.patch("time.time", return_value=1259):
+                self.assertEqual(
+                    CachedURLAuth(
+                        {"object": self.private_attachment}
+                    ).get_full_media_url(authorized=True),
+                    url,
+                )
+            self.assertEqual(add_token.call_count, 1)
+            # Async views share the cache without blocking calls
+            request = RequestFactory().get("/")
+            request.user = self.superuser
+            with mock.patch("time.time", return_value=1230), mock.patch(
+                "crossdomainmedia.auth.get_cached_signed_url",
+                side_effect=AssertionError,
+            ):
+                self.assertEqual(
+                    async_to_sync(
+                        CachedURLAuth(
+                            {"object": self.private_attachment}
+                        ).aget_authorized_media_url
+                    )(request),
+                    url,
+                )
+            self.assertEqual(add_token.call_count, 1)
+            # A new secret key is not served URLs signed with the old one
+            with mock.patch("time.time", return_value=1210):
+                with override_settings(SECRET_KEY="rotated"):
+                    rotated_url = CachedURLAuth(
+                        {"object": self.private_attachment}
+                    ).get_full_media_url(authorized=True)
+            self.assertNotEqual(rotated_url, url)
+            self.assertEqual(add_token.call_count, 2)
+
+        mauth = CachedURLAuth({"object": self.private_attachment})
+        with mock.patch("time.time", return_value=1210):
+            self.assertEqual(mauth.get_signed_url_cache_timeout(), 50)
+        mauth.TOKEN_BUCKET_SECONDS = None
+        self.assertEqual(mauth.get_signed_url_cache_timeout(), 30)
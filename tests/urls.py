@@ -1,8 +1,16 @@
-from django.urls import re_path
+from django.urls import path, re_path
 
-from .views import AttachmentFileDetailView, ExpiredAttachmentFileDetailView
+from crossdomainmedia.refresh import MediaRefreshView
+
+from .views import (
+    AsyncAttachmentFileDetailView,
+    AttachmentFileDetailView,
+    ExpiredAttachmentFileDetailView,
+    StatelessAttachmentFileDetailView,
+)
 
 urlpatterns = [
+    path("media-refresh/", MediaRefreshView.as_view(), name="media_refresh"),
     re_path(
         r"^attachment/(?P<name>.+)",
         AttachmentFileDetailView.as_view(),
@@ -13,4 +21,14 @@ urlpatterns = [
         ExpiredAttachmentFileDetailView.as_view(),
         name="attachment_file_expired",
     ),
+    re_path(
+        r"^attachment-stateless/(?P<name>.+)",
+        StatelessAttachmentFileDetailView.as_view(),
+        name="attachment_file_stateless",
+    ),
+    re_path(
+        r"^attachment-async/(?P<name>.+)",
+        AsyncAttachmentFileDetailView.as_view(),
+        name="attachment_file_async",
+    ),
 ]
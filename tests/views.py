@@ -1,8 +1,11 @@
 from django.views.generic import DetailView
 from django.urls import reverse
+from django.http import Http404
 from django.shortcuts import get_object_or_404
 
-from crossdomainmedia import CrossDomainMediaMixin, CrossDomainMediaAuth
+from crossdomainmedia import (
+    AsyncCrossDomainMediaMixin, CrossDomainMediaMixin, CrossDomainMediaAuth
+)
 
 from .models import Attachment
 
@@ -38,6 +41,15 @@ class ExpiredCustomCrossDomainMediaAuth(CustomCrossDomainMediaAuth):
     URL_NAME = 'attachment_file_expired'
 
 
+class AsyncCustomCrossDomainMediaAuth(CustomCrossDomainMediaAuth):
+    URL_NAME = 'attachment_file_async'
+
+
+class StatelessCustomCrossDomainMediaAuth(CustomCrossDomainMediaAuth):
+    BIND_FILE_PATH = True
+    URL_NAME = 'attachment_file_stateless'
+
+
 class AttachmentFileDetailView(CrossDomainMediaMixin, DetailView):
     media_auth_class = CustomCrossDomainMediaAuth
 
@@ -47,3 +59,17 @@ class AttachmentFileDetailView(CrossDomainMediaMixin, DetailView):
 
 class ExpiredAttachmentFileDetailView(AttachmentFileDetailView):
     media_auth_class = ExpiredCustomCrossDomainMediaAuth
+
+
+class StatelessAttachmentFileDetailView(AttachmentFileDetailView):
+    media_auth_class = StatelessCustomCrossDomainMediaAuth
+
+
+class AsyncAttachmentFileDetailView(AsyncCrossDomainMediaMixin, DetailView):
+    media_auth_class = AsyncCustomCrossDomainMediaAuth
+
+    async def aget_object(self):
+        try:
+            return await Attachment.objects.aget(name=self.kwargs['name'])
+        except Attachment.DoesNotExist:
+            raise Http404